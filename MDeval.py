@@ -20,19 +20,33 @@ you want to share.
 """
 
 
+import numpy as np
 import pandas as pd
+import scipy.sparse
+import pyarrow.parquet
 import csv
+import json
+import mmap
+import hashlib
 import zipfile
 import glob
+import html
 import os
 import shutil
+import sqlite3
 import requests
-import io
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import xlsxwriter
 from pydrive.auth import GoogleAuth
 from pydrive.drive import GoogleDrive
 from lxml import etree
 import sys
+import tempfile
 from IPython.core.display import display, HTML
 
 
@@ -42,11 +56,198 @@ csv.field_size_limit(sys.maxsize)
 # function to download metadata
 
 
-def get_records(urls, xml_files, well_formed=True):
+HARVEST_COLUMNS = ['URL', 'File', 'Status', 'Bytes', 'Elapsed',
+                   'WellFormed', 'Saved', 'Changed', 'Error',
+                   'ETag', 'LastModified', 'SHA256']
+MANIFEST_COLUMNS = ['URL', 'File', 'ETag', 'LastModified', 'SHA256']
+
+
+def harvestSession(workers=1, retries=3, backoff=0.5):
+    """Create a keep-alive ``requests.Session`` for harvesting. The
+    connection pool holds one connection per worker and failed requests
+    (connection errors and 429/5xx responses) are retried ``retries``
+    times with exponential ``backoff``, honouring ``Retry-After``.
+    """
+    retry = Retry(
+        total=retries, backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=True,
+        raise_on_status=False)
+    adapter = HTTPAdapter(
+        pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def hostThrottle(rate_limit=None):
+    """Return a function that blocks until a request to the host of a
+    URL is allowed. ``rate_limit`` is the maximum number of requests per
+    second sent to any single host, ``None`` means no limit.
+    """
+    lock = threading.Lock()
+    next_slot = {}
+
+    def wait(url):
+        if not rate_limit:
+            return
+        host = urllib.parse.urlsplit(url).netloc
+        with lock:
+            now = time.monotonic()
+            slot = max(now, next_slot.get(host, now))
+            next_slot[host] = slot + 1.0 / rate_limit
+        if slot > now:
+            time.sleep(slot - now)
+    return wait
+
+
+def readHarvestManifest(manifest):
+    """Read a harvest manifest csv into a dict keyed by URL. A missing
+    manifest is an empty one.
+    """
+    if manifest is None or not os.path.exists(manifest):
+        return {}
+    manifestDF = pd.read_csv(manifest, dtype=str, keep_default_na=False)
+    return {row['URL']: row for row in manifestDF.to_dict('records')}
+
+
+def writeHarvestManifest(entries, manifest):
+    """Write harvest manifest ``entries`` (a dict keyed by URL) to the
+    ``manifest`` csv, replacing the previous manifest atomically.
+    """
+    manifestDF = pd.DataFrame(list(entries.values()), columns=MANIFEST_COLUMNS)
+    tmp = manifest + '.tmp'
+    manifestDF.to_csv(tmp, mode='w', index=False)
+    os.replace(tmp, manifest)
+
+
+def _fetch_record(session, url, fname, well_formed, throttle, timeout,
+                  entry=None, stream=False, chunk_size=65536):
+    """Download one record and report what happened to it. ``entry`` is
+    the record's harvest manifest row from a previous run, if any.
+    """
+    if fname[-4:] != '.xml':
+        fname += '.xml'
+    result = dict.fromkeys(HARVEST_COLUMNS)
+    result.update(URL=url, File=fname, Bytes=0, Saved=False, Changed=False)
+    headers = {}
+    if entry and os.path.exists(fname):
+        result.update(ETag=entry['ETag'] or None,
+                      LastModified=entry['LastModified'] or None,
+                      SHA256=entry['SHA256'] or None)
+        if result['ETag']:
+            headers['If-None-Match'] = result['ETag']
+        if result['LastModified']:
+            headers['If-Modified-Since'] = result['LastModified']
+    throttle(url)
+    start = time.perf_counter()
+    try:
+        with session.get(url, headers=headers, timeout=timeout,
+                         stream=stream) as r:
+            result['Status'] = r.status_code
+            r.raise_for_status()
+            if r.status_code != 304:
+                result['ETag'] = r.headers.get('ETag')
+                result['LastModified'] = r.headers.get('Last-Modified')
+                if stream:
+                    chunks = r.iter_content(chunk_size)
+                else:
+                    chunks = (r.content,)
+                _store_record(chunks, fname, well_formed, result)
+    except (requests.RequestException, OSError) as e:
+        # a failed download or a file that cannot be written is reported
+        # for this record only
+        result['Error'] = str(e)
+    result['Elapsed'] = time.perf_counter() - start
+    return result
+
+
+class _DiscardTarget(object):
+    """lxml parser target that checks syntax without building a tree."""
+
+    def start(self, tag, attrib):
+        pass
+
+    def end(self, tag):
+        pass
+
+    def data(self, data):
+        pass
+
+    def close(self):
+        return True
+
+
+def _store_record(chunks, fname, well_formed, result):
+    """Write the byte ``chunks`` of a record to ``fname`` through a
+    temporary file, hashing them and (when ``well_formed``) feeding them
+    to an lxml feed parser on the way, so no more than one chunk is held
+    in memory. The file is only replaced when the record is well-formed
+    (if checked) and its hash differs from ``result['SHA256']``.
+    """
+    parser = None
+    if well_formed:
+        parser = etree.XMLParser(target=_DiscardTarget(), huge_tree=True)
+    digest = hashlib.sha256()
+    tmp = fname + '.part'
+    try:
+        with open(tmp, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                digest.update(chunk)
+                result['Bytes'] += len(chunk)
+                if parser is not None and result['WellFormed'] is None:
+                    try:
+                        parser.feed(chunk)
+                    except etree.XMLSyntaxError as e:
+                        result['WellFormed'] = False
+                        result['Error'] = 'Not well-formed: {}'.format(e)
+        if parser is not None and result['WellFormed'] is None:
+            try:
+                parser.close()
+                result['WellFormed'] = True
+            except etree.XMLSyntaxError as e:
+                result['WellFormed'] = False
+                result['Error'] = 'Not well-formed: {}'.format(e)
+
+        if result['WellFormed'] is not False:
+            digest = digest.hexdigest()
+            if digest != result['SHA256'] or not os.path.exists(fname):
+                os.replace(tmp, fname)
+                result['Saved'] = True
+                result['Changed'] = True
+            result['SHA256'] = digest
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def get_records(urls, xml_files, well_formed=True, workers=1,
+                rate_limit=None, retries=3, backoff=0.5, timeout=60,
+                session=None, manifest=None, stream=False,
+                chunk_size=65536):
     """Download metadata records. Metadata records are download from the
     supplied ``urls`` and stored in files whose names are found on
     ``xml_files``. When ``well_formed`` is ``True`` downloaded XML will
     be saved to a file only if well-formed.
+
+    Records are fetched by ``workers`` threads sharing one pooled
+    keep-alive session (see ``harvestSession``), with at most
+    ``rate_limit`` requests per second to each host. Returns a dataframe
+    with one row per URL: HTTP status, bytes received, elapsed seconds,
+    the well-formed flag, whether the file was saved and any error.
+
+    When ``manifest`` names a csv file, the ETag, Last-Modified and
+    SHA-256 of every saved record are kept there. Re-runs send
+    conditional requests for records already on disk, and files whose
+    content has not changed (304 or same hash) are left alone. Use the
+    ``Changed`` column of the result to process only updated records.
+
+    With ``stream`` the response is written to disk as raw bytes in
+    ``chunk_size`` pieces while being checked by an incremental parser,
+    so memory per worker stays bounded however large the record is.
+    Records are always saved byte for byte, keeping their encoding.
     """
     """ if we used a function
     like this to collect xml, it would be the root of any processing steps
@@ -54,24 +255,37 @@ def get_records(urls, xml_files, well_formed=True):
     if len(urls) != len(xml_files):
         raise ValueError('Different number of URLs and record file names')
 
-    for url, fname in zip(urls, xml_files):
-        try:
-            r = requests.get(url)
-            r.raise_for_status()
-        except Exception:
-            print('There was an error downloading from {}'.format(url))
-
-        if well_formed:
-            try:
-                etree.fromstring(r.text)
-            except Exception:
-                print('Metadata record from {} not well-formed'.format(url))
-
-        if fname[-4:] != '.xml':
-            fname += '.xml'
-
-        with open(fname, 'wt') as f:
-            f.write(r.text)
+    own_session = session is None
+    if own_session:
+        session = harvestSession(workers, retries, backoff)
+    throttle = hostThrottle(rate_limit)
+    entries = readHarvestManifest(manifest)
+
+    def fetch(pair):
+        return _fetch_record(
+            session, pair[0], pair[1], well_formed, throttle, timeout,
+            entries.get(pair[0]), stream, chunk_size)
+
+    results = []
+    try:
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for result in pool.map(fetch, zip(urls, xml_files)):
+                    results.append(result)
+        else:
+            for pair in zip(urls, xml_files):
+                results.append(fetch(pair))
+    finally:
+        if own_session:
+            session.close()
+        # keep what was saved even if the harvest stopped part way
+        if manifest is not None:
+            for result in results:
+                if result['SHA256'] is not None:
+                    entries[result['URL']] = {
+                        key: result[key] or '' for key in MANIFEST_COLUMNS}
+            writeHarvestManifest(entries, manifest)
+    return pd.DataFrame(results, columns=HARVEST_COLUMNS)
 
 
 ''' This function allows the user to unify the namespace location and
@@ -79,211 +293,1175 @@ if neccessary, the prefix.
 '''
 
 
+def _normalizeFile(filepath, old, new, mmap_threshold):
+    """Replace ``old`` by ``new`` in one file, working on bytes. Large
+    files are memory-mapped and the pieces around each match written
+    through a memoryview, so they are not copied into memory. The
+    rewritten file is moved into place with an atomic rename. Returns
+    the number of bytes written, 0 if the file did not need changing.
+    """
+    size = os.path.getsize(filepath)
+    if size == 0:
+        return 0
+    with open(filepath, 'rb') as src:
+        if size < mmap_threshold:
+            data = src.read()
+        else:
+            data = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            position = data.find(old)
+            if position == -1:
+                return 0
+            directory, name = os.path.split(filepath)
+            fd, tmp = tempfile.mkstemp(prefix='.' + name, dir=directory)
+            written = 0
+            try:
+                with os.fdopen(fd, 'wb') as dst, memoryview(data) as view:
+                    start = 0
+                    while position != -1:
+                        written += dst.write(view[start:position])
+                        written += dst.write(new)
+                        start = position + len(old)
+                        position = data.find(old, start)
+                    written += dst.write(view[start:])
+                shutil.copymode(filepath, tmp)
+                os.replace(tmp, filepath)
+            except BaseException:
+                os.remove(tmp)
+                raise
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+    return written
+
+
 def normalizeNamespace(MetadataLocation,
-                       newNamespaceLocation, oldNamespaceLocation):
-    for filepath in glob.iglob(MetadataLocation + '/*.xml', recursive=True):
-        with open(filepath) as file:
-            s = file.read()
-        s = s.replace(oldNamespaceLocation, newNamespaceLocation)
-        with open(filepath, "w") as file:
-            file.write(s)
-        print(str(filepath) + ' is normalized')
+                       newNamespaceLocation, oldNamespaceLocation,
+                       workers=None, mmap_threshold=2 ** 24):
+    """Replace ``oldNamespaceLocation`` by ``newNamespaceLocation`` in
+    the xml files of ``MetadataLocation``, using ``workers`` processes
+    (all cores by default). Files without the old namespace are not
+    touched and each changed file is replaced atomically, so a crash
+    never leaves a half written record. Returns a dict with the number
+    of files scanned and changed, the bytes rewritten and elapsed time.
+    """
+    start = time.perf_counter()
+    files = list(glob.iglob(MetadataLocation + '/*.xml', recursive=True))
+    old = oldNamespaceLocation.encode('utf-8')
+    new = newNamespaceLocation.encode('utf-8')
+    n = len(files)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        written = list(pool.map(
+            _normalizeFile, files, [old] * n, [new] * n,
+            [mmap_threshold] * n, chunksize=max(1, n // 64)))
+    return {'FilesScanned': n,
+            'FilesChanged': sum(1 for w in written if w),
+            'BytesRewritten': sum(written),
+            'Elapsed': time.perf_counter() - start}
 
 
 # function to interact with the Metadata Evaluation Web Service
 
-def XMLeval(MetadataLocation, Organization, Collection, Dialect):
+EVALUATOR_URL = 'http://metadig.nceas.ucsb.edu/metadata/evaluator'
+EVALUATOR_MEMBERS = {'AllNodes.csv': '_ElementEvaluated.csv',
+                     'KnownNodes.csv': '_ConceptEvaluated.csv'}
 
-    MetadataDestination = os.path.join('./zip/', Organization,
-                                       Collection, Dialect, 'xml')
-    os.makedirs(MetadataDestination, exist_ok=True)
-    src_files = os.listdir(MetadataLocation)
-    for file_name in src_files:
-        full_file_name = os.path.join(MetadataLocation, file_name)
-        if (os.path.isfile(full_file_name)):
-            shutil.copy(full_file_name, MetadataDestination)
-    shutil.make_archive('./upload/metadata', 'zip', './zip/')
-
-    # Send metadata package, read the response into a dataframe
-    url = 'http://metadig.nceas.ucsb.edu/metadata/evaluator'
-    files = {'zipxml': open('./upload/metadata.zip', 'rb')}
-    r = requests.post(url, files=files, headers={"Accept-Encoding": "zip"})
-    r.raise_for_status()
-    z = zipfile.ZipFile(io.BytesIO(r.content))
-    z.extractall('./data/')
-    old_element = os.path.join('./data/', "AllNodes.csv")
-    new_element = os.path.join(
-        './data/', Organization, Collection +
-        '_' + Dialect + "_ElementEvaluated.csv"
-    )
-    os.rename(old_element, new_element)
-    old_concept = os.path.join('./data/', "KnownNodes.csv")
-    new_concept = os.path.join(
-        './data/', Organization, Collection +
-        '_' + Dialect + "_ConceptEvaluated.csv"
-    )
-    os.rename(old_concept, new_concept)
-    """Change directories, delete upload directory and zip.
-    Delete copied metadata.
+
+class _ChunkSink(object):
+    """Unseekable file object collecting what is written to it, so a
+    zip can be produced piece by piece by a generator.
     """
-    shutil.rmtree('./upload')
 
-    shutil.rmtree('./zip/')
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def _recordBatches(MetadataLocation, batch_records=None, batch_bytes=None):
+    """Split the files of ``MetadataLocation``, in name order, into
+    batches of at most ``batch_records`` files and ``batch_bytes`` bytes
+    (a larger file gets a batch of its own). Without limits all files are
+    one batch.
+    """
+    batches, batch, size = [], [], 0
+    for file_name in sorted(os.listdir(MetadataLocation)):
+        full_file_name = os.path.join(MetadataLocation, file_name)
+        if not os.path.isfile(full_file_name):
+            continue
+        fileSize = os.path.getsize(full_file_name)
+        if batch and (
+                (batch_records and len(batch) >= batch_records) or
+                (batch_bytes and size + fileSize > batch_bytes)):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(file_name)
+        size += fileSize
+    if batch or not batches:
+        batches.append(batch)
+    return batches
+
+
+def _zipRecords(MetadataLocation, ArchivePrefix, chunk_size=65536,
+                files=None):
+    """Generate a zip of the files of ``MetadataLocation`` (or of just
+    ``files``), each stored as ``ArchivePrefix``/file name, as it is
+    compressed. The files are read ``chunk_size`` bytes at a time and
+    never copied or held whole.
+    """
+    if files is None:
+        files = sorted(os.listdir(MetadataLocation))
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as z:
+        for file_name in files:
+            full_file_name = os.path.join(MetadataLocation, file_name)
+            if not os.path.isfile(full_file_name):
+                continue
+            zinfo = zipfile.ZipInfo.from_file(
+                full_file_name, ArchivePrefix + '/' + file_name)
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            with open(full_file_name, 'rb') as src, z.open(zinfo, 'w') as dst:
+                for chunk in iter(lambda: src.read(chunk_size), b''):
+                    dst.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
+
+
+def _multipartBody(boundary, name, filename, chunks):
+    """Generate a multipart/form-data body with a single file field whose
+    content comes from the ``chunks`` iterable.
+    """
+    yield ('--{}\r\nContent-Disposition: form-data; name="{}"; '
+           'filename="{}"\r\nContent-Type: application/zip\r\n\r\n'
+           .format(boundary, name, filename).encode())
+    for chunk in chunks:
+        if chunk:
+            yield chunk
+    yield '\r\n--{}--\r\n'.format(boundary).encode()
+
+
+def _postBatch(session, url, MetadataLocation, ArchivePrefix, files,
+               chunk_size, spool_size, WorkLocation, timeout):
+    """Send one batch of records to the evaluator and return its response
+    zip spooled to a temporary file, after checking that it holds the
+    ``EVALUATOR_MEMBERS``.
+    """
+    boundary = os.urandom(16).hex()
+    body = _multipartBody(boundary, 'zipxml', 'metadata.zip', _zipRecords(
+        MetadataLocation, ArchivePrefix, chunk_size, files))
+    headers = {'Accept-Encoding': 'zip', 'Content-Type':
+               'multipart/form-data; boundary=' + boundary}
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_size,
+                                          dir=WorkLocation)
+    try:
+        with session.post(url, data=body, headers=headers, stream=True,
+                          timeout=timeout) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size):
+                spool.write(chunk)
+        spool.seek(0)
+        with zipfile.ZipFile(spool) as z:
+            missing = set(EVALUATOR_MEMBERS) - set(z.namelist())
+            if missing:
+                raise KeyError('evaluator response is missing ' +
+                               ', '.join(sorted(missing)))
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def XMLeval(MetadataLocation, Organization, Collection, Dialect,
+            DataLocation='./data/', WorkLocation=None, chunk_size=65536,
+            spool_size=2**26, url=None, batch_records=None,
+            batch_bytes=None, workers=1, retries=3, backoff=0.5,
+            timeout=None, session=None, load=False):
+    """Evaluate the records in ``MetadataLocation`` with the Metadata
+    Evaluation Web Service at ``url`` (``EVALUATOR_URL`` by default) and
+    write the ElementEvaluated and ConceptEvaluated csv files to
+    ``DataLocation``/``Organization``.
+    The records are zipped as they are uploaded, in a streamed multipart
+    body, and each response is streamed into a temporary file that stays
+    in memory up to ``spool_size`` bytes (and otherwise goes to
+    ``WorkLocation``, the system temporary directory by default).
+    A large collection can be sent in batches of ``batch_records`` records
+    or ``batch_bytes`` bytes, ``workers`` batches at a time. Batches that
+    fail are sent again, alone, up to ``retries`` times with exponential
+    ``backoff``; the results of all batches are merged in record order,
+    straight from the responses to the csv files.
+    Returns the paths of the ElementEvaluated and ConceptEvaluated files,
+    or with ``load`` the tables read back from them as dataframes.
+    """
+    if url is None:
+        url = EVALUATOR_URL
+    ArchivePrefix = '/'.join([Organization, Collection, Dialect, 'xml'])
+    batches = _recordBatches(MetadataLocation, batch_records, batch_bytes)
+    own_session = session is None
+    if own_session:
+        session = harvestSession(workers, retries=0)
+
+    # Send metadata packages, merge the responses into the csv files
+    spools = [None] * len(batches)
+    try:
+        pending = list(range(len(batches)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for attempt in range(retries + 1):
+                if attempt:
+                    time.sleep(backoff * 2 ** (attempt - 1))
+                futures = [(i, executor.submit(
+                    _postBatch, session, url, MetadataLocation,
+                    ArchivePrefix, batches[i], chunk_size, spool_size,
+                    WorkLocation, timeout)) for i in pending]
+                failed, errors = [], []
+                for i, future in futures:
+                    try:
+                        spools[i] = future.result()
+                    except (requests.RequestException, zipfile.BadZipFile,
+                            KeyError) as e:
+                        failed.append(i)
+                        errors.append(e)
+                pending = failed
+                if not pending:
+                    break
+        if pending:
+            raise errors[0]
+
+        os.makedirs(os.path.join(DataLocation, Organization), exist_ok=True)
+        results = []
+        for member, suffix in EVALUATOR_MEMBERS.items():
+            result = os.path.join(
+                DataLocation, Organization,
+                Collection + '_' + Dialect + suffix)
+            with open(result + '.part', 'wb') as dst:
+                for i, spool in enumerate(spools):
+                    spool.seek(0)
+                    with zipfile.ZipFile(spool) as z:
+                        with z.open(member) as src:
+                            if i:
+                                # keep the header of the first batch only
+                                src.readline()
+                            shutil.copyfileobj(src, dst, chunk_size)
+            os.replace(result + '.part', result)
+            results.append(result)
+    finally:
+        for spool in spools:
+            if spool is not None:
+                spool.close()
+        if own_session:
+            session.close()
 
     print(
-        'Metadata evaluated. Results in the "./data/' +
-        Organization + '" directory.'
+        'Metadata evaluated. Results in the "' +
+        os.path.join(DataLocation, Organization) + '" directory.'
     )
+    if load:
+        return tuple(readTable(result) for result in results)
+    return tuple(results)
+
+
+# functions to store evaluated metadata and data products
+
+CATEGORICAL_COLUMNS = ['Collection', 'Dialect', 'Record', 'XPath', 'Concept']
+
+
+def readTable(DataLocation, columns=None):
+    """Read an evaluated metadata table or data product. Files ending in
+    .parquet are read from the columnar store, anything else as a
+    (possibly compressed) csv.
+    """
+    if DataLocation.endswith('.parquet'):
+        return pd.read_parquet(DataLocation, columns=columns)
+    return pd.read_csv(DataLocation, usecols=columns)
+
+
+def writeTable(DF, DataDestination, **kwargs):
+    """Write an evaluated metadata table or data product. When
+    ``DataDestination`` ends in .parquet the table is stored as Parquet
+    with Collection, Dialect, Record, XPath and Concept encoded as
+    categoricals and sparse columns made dense; otherwise it is written
+    as csv, passing ``kwargs``
+    on to ``DataFrame.to_csv``.
+    """
+    if not DataDestination.endswith('.parquet'):
+        DF.to_csv(DataDestination, mode='w', index=False, **kwargs)
+        return
+    DF = DF.copy(deep=False)
+    for column in DF.columns:
+        if isinstance(DF[column].dtype, pd.SparseDtype):
+            DF[column] = DF[column].sparse.to_dense()
+        elif column in CATEGORICAL_COLUMNS:
+            DF[column] = DF[column].astype('category')
+        elif DF[column].dtype == object and pd.api.types.infer_dtype(
+                DF[column], skipna=True).startswith('mixed'):
+            DF[column] = DF[column].astype(str)
+    DF.columns = [str(column) for column in DF.columns]
+    DF.to_parquet(DataDestination, index=False)
+
+
+# functions to evaluate metadata locally, without the web service
+
+EVALUATED_XPATH_COLUMNS = ['Collection', 'Record', 'XPath', 'Content']
+EVALUATED_CONCEPT_COLUMNS = ['Collection', 'Dialect', 'Record', 'Concept',
+                             'XPath', 'Content']
+
+
+def readCrosswalk(CrosswalkLocation, Dialect):
+    """Read the concept mappings of ``Dialect`` from a crosswalk file like
+    AllCrosswalks.xml, laid out as::
+
+        <Crosswalks>
+          <Dialect name="ISO">
+            <Namespace prefix="gmd" uri="http://www.isotc211.org/2005/gmd"/>
+            <Concept name="Resource Title">
+              <XPath>/*/gmd:identificationInfo//gmd:title</XPath>
+            </Concept>
+          </Dialect>
+        </Crosswalks>
+
+    Element names are matched without regard to namespace. Returns a
+    dataframe of Concept and XPath, and a dict of namespace prefixes.
+    """
+    crosswalk = []
+    namespaces = {}
+    tree = etree.parse(CrosswalkLocation)
+    for dialect in tree.iter('{*}Dialect'):
+        if dialect.get('name') != Dialect:
+            continue
+        for namespace in dialect.iter('{*}Namespace'):
+            namespaces[namespace.get('prefix')] = namespace.get('uri')
+        for concept in dialect.iter('{*}Concept'):
+            for xpath in concept.iter('{*}XPath'):
+                crosswalk.append([concept.get('name'), xpath.text.strip()])
+    if not crosswalk:
+        raise ValueError(
+            'No {} mappings in {}'.format(Dialect, CrosswalkLocation))
+    return pd.DataFrame(crosswalk, columns=['Concept', 'XPath']), namespaces
+
+
+_crosswalkIndexes = {}
+
+
+def crosswalkIndex(CrosswalkLocation, Dialect, CacheLocation=None):
+    """Return the ``Dialect`` mappings of a crosswalk as a list of
+    (Concept, XPath, compiled ``etree.XPath``) with the dialect's
+    namespaces bound, so every prefix used in a mapping must be declared
+    by a Namespace element. The index is built once per process and
+    Dialect. The parsed mappings are cached as json in ``CacheLocation``
+    (by default a .crosswalk_cache directory next to the crosswalk) and
+    both caches are rebuilt when the crosswalk file changes.
+    """
+    CrosswalkLocation = os.path.abspath(CrosswalkLocation)
+    stat = os.stat(CrosswalkLocation)
+    version = [stat.st_mtime_ns, stat.st_size]
+    key = (CrosswalkLocation, Dialect)
+    cached = _crosswalkIndexes.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    if CacheLocation is None:
+        CacheLocation = os.path.join(
+            os.path.dirname(CrosswalkLocation), '.crosswalk_cache')
+    cacheFile = os.path.join(CacheLocation, Dialect + '.json')
+    mappings = None
+    if os.path.exists(cacheFile):
+        with open(cacheFile) as f:
+            cache = json.load(f)
+        if (cache['Crosswalk'] == CrosswalkLocation and
+                cache['Version'] == version):
+            mappings, namespaces = cache['Mappings'], cache['Namespaces']
+    if mappings is None:
+        crosswalk, namespaces = readCrosswalk(CrosswalkLocation, Dialect)
+        mappings = crosswalk.values.tolist()
+        os.makedirs(CacheLocation, exist_ok=True)
+        tmp = '{}.{}.tmp'.format(cacheFile, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'Crosswalk': CrosswalkLocation, 'Version': version,
+                       'Mappings': mappings, 'Namespaces': namespaces}, f)
+        os.replace(tmp, cacheFile)
+
+    index = [(concept, xpath, etree.XPath(xpath, namespaces=namespaces))
+             for concept, xpath in mappings]
+    _crosswalkIndexes[key] = (version, index)
+    return index
+
+
+def _prefixedName(name, prefix):
+    localname = etree.QName(name).localname
+    if prefix:
+        return prefix + ':' + localname
+    return localname
+
+
+def recordXpaths(root, Collection, Record):
+    """Yield a (Collection, Record, XPath, Content) row for every element
+    and attribute of the parsed record ``root``, in document order. The
+    XPath uses the prefixes declared in the record.
+    """
+    stack = [(root, '/' + _prefixedName(root.tag, root.prefix))]
+    while stack:
+        element, path = stack.pop()
+        yield [Collection, Record, path, (element.text or '').strip()]
+        if element.attrib:
+            prefixes = {uri: prefix for prefix, uri in element.nsmap.items()}
+            for name, value in element.attrib.items():
+                prefix = prefixes.get(etree.QName(name).namespace)
+                yield [Collection, Record,
+                       path + '/@' + _prefixedName(name, prefix), value]
+        children = [
+            (child, path + '/' + _prefixedName(child.tag, child.prefix))
+            for child in element if isinstance(child.tag, str)]
+        stack.extend(reversed(children))
+
+
+def iterXpaths(filepath, Collection, Record=None):
+    """Yield the same rows as ``recordXpaths``, in the same order, while
+    ``filepath`` is parsed with ``etree.iterparse``. Elements are cleared
+    once their rows are out, so memory stays flat however large the
+    record is. A record that is not well-formed raises XMLSyntaxError
+    after the rows of its well-formed part.
+    """
+    if Record is None:
+        Record = os.path.basename(filepath)
+    stack = []
+
+    def rows(element, path):
+        yield [Collection, Record, path, (element.text or '').strip()]
+        if element.attrib:
+            prefixes = {uri: prefix for prefix, uri in element.nsmap.items()}
+            for name, value in element.attrib.items():
+                prefix = prefixes.get(etree.QName(name).namespace)
+                yield [Collection, Record,
+                       path + '/@' + _prefixedName(name, prefix), value]
+
+    for event, element in etree.iterparse(
+            filepath, events=('start', 'end'), huge_tree=True):
+        if event == 'start':
+            path = '/' + _prefixedName(element.tag, element.prefix)
+            if stack:
+                parent = stack[-1]
+                # the parent's text is complete once a child starts
+                if not parent[2]:
+                    yield from rows(parent[0], parent[1])
+                    parent[2] = True
+                path = parent[1] + path
+            stack.append([element, path, False])
+        else:
+            element, path, done = stack.pop()
+            if not done:
+                yield from rows(element, path)
+            element.clear(keep_tail=True)
+            # the root has no parent, only the comments and processing
+            # instructions that may come before it
+            parent = element.getparent()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+
+
+def recordConcepts(root, Collection, Dialect, Record, index):
+    """Yield a (Collection, Dialect, Record, Concept, XPath, Content) row
+    for every node of the parsed record ``root`` matched by the compiled
+    mappings of a ``crosswalkIndex``.
+    """
+    for concept, xpath, compiled in index:
+        try:
+            found = compiled(root)
+        except etree.XPathEvalError:
+            continue
+        if not isinstance(found, list):
+            found = [found]
+        for node in found:
+            if isinstance(node, etree._Element):
+                content = (node.text or '').strip()
+            else:
+                content = str(node).strip()
+            yield [Collection, Dialect, Record, concept, xpath, content]
+
+
+def _evaluateChunk(files, Collection, Dialect, CrosswalkLocation,
+                   iterparse=False):
+    """Parse each record once and collect its xpath rows and, given a
+    crosswalk, its concept rows, both returned as lists of columns.
+    Without a crosswalk, ``iterparse`` collects the xpath rows with
+    ``iterXpaths`` instead of building trees. Records that are not
+    well-formed are skipped.
+    """
+    index = None
+    if CrosswalkLocation is not None:
+        index = crosswalkIndex(CrosswalkLocation, Dialect)
+    parser = etree.XMLParser(huge_tree=True)
+    xpathRows = []
+    conceptRows = []
+    for filepath in files:
+        Record = os.path.basename(filepath)
+        if iterparse and index is None:
+            try:
+                xpathRows.extend(list(iterXpaths(filepath, Collection)))
+            except etree.XMLSyntaxError:
+                pass
+            continue
+        try:
+            root = etree.parse(filepath, parser).getroot()
+        except etree.XMLSyntaxError:
+            continue
+        xpathRows.extend(recordXpaths(root, Collection, Record))
+        if index is not None:
+            conceptRows.extend(recordConcepts(
+                root, Collection, Dialect, Record, index))
+    return list(zip(*xpathRows)), list(zip(*conceptRows))
+
+
+def _evaluateRecords(files, Collection, Dialect, CrosswalkLocation=None,
+                     workers=1, chunksize=64, iterparse=False):
+    """Evaluate ``files`` serially or, when ``workers`` > 1, in a process
+    pool working on shards of ``chunksize`` records. Shards are merged
+    in file order, so both paths give identical tables.
+    """
+    if workers > 1 and len(files) > chunksize:
+        shards = [files[i:i + chunksize]
+                  for i in range(0, len(files), chunksize)]
+        n = len(shards)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(
+                _evaluateChunk, shards, [Collection] * n, [Dialect] * n,
+                [CrosswalkLocation] * n, [iterparse] * n))
+    else:
+        parts = [_evaluateChunk(
+            files, Collection, Dialect, CrosswalkLocation, iterparse)]
+
+    tables = []
+    for position, columns in enumerate(
+            (EVALUATED_XPATH_COLUMNS, EVALUATED_CONCEPT_COLUMNS)):
+        merged = {column: [] for column in columns}
+        for part in parts:
+            for column, values in zip(columns, part[position]):
+                merged[column].extend(values)
+        tables.append(pd.DataFrame(merged, columns=columns))
+    return tables[0], tables[1]
+
+
+def _recordFiles(MetadataLocation, Records=None):
+    if Records is None:
+        Records = os.listdir(MetadataLocation)
+    return sorted(
+        os.path.join(MetadataLocation, file_name)
+        for file_name in Records
+        if file_name.endswith('.xml') and
+        os.path.isfile(os.path.join(MetadataLocation, file_name)))
+
+
+def localAllNodesEval(MetadataLocation, Collection, DataDestination=None,
+                      workers=1, chunksize=64, iterparse=False,
+                      Records=None):
+    """Create the ElementEvaluated table (Collection, Record, XPath,
+    Content) for the records in ``MetadataLocation`` without the web
+    service. It is required for XpathCounts and xpathOccurrence.
+    Records are shared out to ``workers`` processes ``chunksize`` at
+    a time. Use ``iterparse`` for very large records; the table is the
+    same but records are never held in memory as whole trees.
+    ``Records`` limits the evaluation to the named record files.
+    """
+    ElementDF, _ = _evaluateRecords(
+        _recordFiles(MetadataLocation, Records), Collection, None,
+        workers=workers, chunksize=chunksize, iterparse=iterparse)
+    if DataDestination is not None:
+        DataDestinationDirectory = DataDestination[
+            :DataDestination.rfind('/') + 1]
+        os.makedirs(DataDestinationDirectory, exist_ok=True)
+        writeTable(ElementDF, DataDestination)
+    return ElementDF
+
+
+def localKnownNodesEval(MetadataLocation, Collection, Dialect,
+                        CrosswalkLocation='./AllCrosswalks.xml',
+                        DataDestination=None, workers=1, chunksize=64,
+                        Records=None):
+    """Create the ConceptEvaluated table (Collection, Dialect, Record,
+    Concept, XPath, Content) for the records in ``MetadataLocation``
+    using the ``Dialect`` mappings of the crosswalk. It is required for
+    conceptCounts and conceptOccurrence. ``Records`` limits the
+    evaluation to the named record files.
+    """
+    # build (or validate) the cached index once before any worker needs it
+    crosswalkIndex(CrosswalkLocation, Dialect)
+    _, ConceptDF = _evaluateRecords(
+        _recordFiles(MetadataLocation, Records), Collection, Dialect,
+        CrosswalkLocation, workers, chunksize)
+    if DataDestination is not None:
+        DataDestinationDirectory = DataDestination[
+            :DataDestination.rfind('/') + 1]
+        os.makedirs(DataDestinationDirectory, exist_ok=True)
+        writeTable(ConceptDF, DataDestination)
+    return ConceptDF
+
+
+def localXMLeval(MetadataLocation, Organization, Collection, Dialect,
+                 CrosswalkLocation='./AllCrosswalks.xml',
+                 DataLocation='./data/', workers=1, chunksize=64,
+                 Format='csv'):
+    """Offline replacement for XMLeval. Each record is parsed once to
+    build both the ElementEvaluated and ConceptEvaluated tables, which
+    are written to the same files XMLeval produces and returned.
+    With ``workers`` > 1 the records are evaluated in a process pool,
+    ``chunksize`` records per task; the tables are the same either way.
+    ``Format`` is 'csv' or 'parquet' (see ``writeTable``).
+    """
+    # build (or validate) the cached index once before any worker needs it
+    crosswalkIndex(CrosswalkLocation, Dialect)
+    ElementDF, ConceptDF = _evaluateRecords(
+        _recordFiles(MetadataLocation), Collection, Dialect,
+        CrosswalkLocation, workers, chunksize)
+    os.makedirs(os.path.join(DataLocation, Organization), exist_ok=True)
+    writeTable(ElementDF, os.path.join(
+        DataLocation, Organization,
+        Collection + '_' + Dialect + '_ElementEvaluated.' + Format))
+    writeTable(ConceptDF, os.path.join(
+        DataLocation, Organization,
+        Collection + '_' + Dialect + '_ConceptEvaluated.' + Format))
+    return ElementDF, ConceptDF
 
 
 # Create a Recommendations Analysis data table
 
 
+def _groupCounts(EvaluatedMetadataDF, columns):
+    """``groupby(columns).size()`` of an evaluated table. The table may
+    also be an iterator of chunks, such as ``pd.read_csv(...,
+    chunksize=...)``, ``readEvaluatedChunks`` or Arrow record batches.
+    Partial counts of the chunks are held until they add up to as many
+    entries as the counts merged so far, then merged in one go, so the
+    work is linear in the rows and memory follows the number of distinct
+    (record, key) pairs, not the rows.
+    """
+    if isinstance(EvaluatedMetadataDF, pd.DataFrame):
+        return EvaluatedMetadataDF.groupby(columns, observed=True).size()
+    levels = list(range(len(columns)))
+    counts = pd.Series(
+        [], dtype='int64',
+        index=pd.MultiIndex.from_arrays([[]] * len(columns), names=columns))
+    parts, pending = [], 0
+
+    def merge():
+        return pd.concat([counts] + parts).groupby(
+            level=levels, observed=True).sum()
+
+    for chunk in EvaluatedMetadataDF:
+        if not isinstance(chunk, pd.DataFrame):
+            chunk = chunk.to_pandas()
+        missing = [column for column in columns
+                   if column not in chunk.columns]
+        if missing:
+            raise KeyError('evaluated chunk has no {} column'.format(
+                ', '.join(missing)))
+        part = chunk.groupby(columns, observed=True).size()
+        parts.append(part)
+        pending += len(part)
+        if pending >= len(counts):
+            counts = merge()
+            parts, pending = [], 0
+    if parts:
+        counts = merge()
+    return counts.astype('int64')
+
+
+# the columns the counting and occurrence functions group by
+EVALUATED_KEY_COLUMNS = ['Collection', 'Record', 'XPath', 'Concept']
+
+
+def readEvaluatedChunks(DataLocation, chunksize=100000, columns=None):
+    """Read an evaluated metadata table (csv, gzip csv or parquet) in
+    chunks of ``chunksize`` rows, keeping only ``columns``: by default
+    Collection, Record and whichever of XPath and Concept the table has.
+    The chunks can be passed to the counting and occurrence functions in
+    place of the whole table.
+    """
+    if DataLocation.endswith('.parquet'):
+        parquet = pyarrow.parquet.ParquetFile(DataLocation)
+        names = parquet.schema_arrow.names
+    else:
+        names = list(pd.read_csv(DataLocation, nrows=0).columns)
+    if columns is None:
+        columns = [column for column in EVALUATED_KEY_COLUMNS
+                   if column in names]
+    columns = list(columns)
+    missing = [column for column in columns if column not in names]
+    if missing:
+        raise KeyError('{} has no {} column'.format(
+            DataLocation, ', '.join(missing)))
+    if DataLocation.endswith('.parquet'):
+        for batch in parquet.iter_batches(
+                batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(
+            DataLocation, usecols=columns, chunksize=chunksize)
+
+
+def iterXpathChunks(MetadataLocation, Collection, chunksize=100000):
+    """Stream the ElementEvaluated rows of the records in
+    ``MetadataLocation`` with ``iterXpaths`` as dataframes of up to
+    ``chunksize`` rows, ready for XpathCounts or xpathOccurrence.
+    Records that are not well-formed are skipped.
+    """
+    rows = []
+    for filepath in _recordFiles(MetadataLocation):
+        try:
+            rows.extend(list(iterXpaths(filepath, Collection)))
+        except etree.XMLSyntaxError:
+            continue
+        full = len(rows) - len(rows) % chunksize
+        for start in range(0, full, chunksize):
+            yield pd.DataFrame(
+                rows[start:start + chunksize],
+                columns=EVALUATED_XPATH_COLUMNS)
+        del rows[:full]
+    if rows:
+        yield pd.DataFrame(rows, columns=EVALUATED_XPATH_COLUMNS)
+
+
+def _countFrame(counts, sparse=False):
+    """Pivot ``counts``, a Series indexed by the record columns and then
+    the key (XPath or Concept), into one row per record holding the
+    record columns and one integer count column per key. With ``sparse``
+    the count columns are built from a scipy sparse matrix and use
+    ``SparseDtype``, so zero counts take no memory.
+    """
+    if not sparse:
+        Matrix = counts.unstack(fill_value=0)
+        Matrix.columns.name = None
+        return Matrix.reset_index()
+    recordCodes, records = counts.index.droplevel(-1).factorize()
+    records = records.set_names(counts.index.names[:-1])
+    keyCodes, keys = pd.factorize(
+        counts.index.get_level_values(-1), sort=True)
+    matrix = scipy.sparse.csr_matrix(
+        (counts.to_numpy(dtype='int64'), (recordCodes, keyCodes)),
+        shape=(len(records), len(keys)))
+    Matrix = pd.DataFrame.sparse.from_spmatrix(matrix, columns=keys)
+    return pd.concat(
+        [pd.DataFrame(index=records).reset_index(), Matrix], axis=1)
+
+
+def _countMatrix(EvaluatedMetadataDF, Key, sparse=False,
+                 by=('Collection', 'Record')):
+    """Count the rows of each ``Key`` value for every record, grouped by
+    the ``by`` columns. See ``_countFrame`` for the result.
+    """
+    counts = _groupCounts(EvaluatedMetadataDF, list(by) + [Key])
+    return _countFrame(counts, sparse)
+
+
+def _columnTotals(occurrenceMatrix):
+    """Sum and count the non-zero cells of each count column of a
+    Record-indexed count matrix, sparse or dense. Returns the keys, the
+    sums, the non-zero counts and the number of records.
+    """
+    counts = occurrenceMatrix.drop(columns='Record')
+    if len(counts.columns) and all(
+            isinstance(dtype, pd.SparseDtype) for dtype in counts.dtypes):
+        matrix = counts.sparse.to_coo()
+        sums = np.asarray(matrix.sum(axis=0)).ravel()
+        nonzero = (matrix != 0).sum(axis=0).A1
+    else:
+        values = counts.to_numpy()
+        sums = values.sum(axis=0)
+        nonzero = np.count_nonzero(values, axis=0)
+    return counts.columns, sums, nonzero, len(occurrenceMatrix)
+
+
+def _groupTotals(counts):
+    """``_columnTotals`` computed straight from ``counts``, a Series of
+    counts indexed by Collection, Record and key, without a matrix.
+    """
+    byKey = counts.groupby(level=-1, observed=True)
+    sums = byKey.sum()
+    return (sums.index, sums.to_numpy(), byKey.size().to_numpy(),
+            len(counts.index.droplevel(-1).unique()))
+
+
+# the dialect registry used when no DialectLocation is given, set to the
+# dialectContains.csv of the working directory when first found there
+DIALECT_LOCATION = None
+_dialectRegistries = {}
+
+
+def _dialectLocation(DialectLocation=None):
+    global DIALECT_LOCATION
+    if DialectLocation is not None:
+        return os.path.abspath(DialectLocation)
+    if DIALECT_LOCATION is None:
+        DialectLocation = os.path.abspath('dialectContains.csv')
+        if not os.path.exists(DialectLocation):
+            return DialectLocation
+        DIALECT_LOCATION = DialectLocation
+    return DIALECT_LOCATION
+
+
+def dialectRegistry(DialectLocation=None):
+    """Return dialectContains.csv as a dict of Dialect to its fill values,
+    {Concept: value} in the order of the file's columns. The file is read
+    once per process and read again when it changes. ``DialectLocation``
+    defaults to the dialectContains.csv of the working directory the
+    first time one is found there, so later changes of directory do not
+    lose it.
+    """
+    DialectLocation = _dialectLocation(DialectLocation)
+    stat = os.stat(DialectLocation)
+    version = [stat.st_mtime_ns, stat.st_size]
+    cached = _dialectRegistries.get(DialectLocation)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    dialectOccurrenceDF = pd.read_csv(DialectLocation)
+    concepts = [concept for concept in dialectOccurrenceDF.columns
+                if concept not in ('Collection', 'Record', 'Concept')]
+    registry = {
+        row['Concept']: {concept: row[concept] for concept in concepts}
+        for row in dialectOccurrenceDF.to_dict('records')}
+    _dialectRegistries[DialectLocation] = (version, registry)
+    return registry
+
+
+def dialectFillValues(Dialect, DialectLocation=None):
+    """Return a copy of the ``Dialect`` fill values of the dialect
+    registry; its keys are the dialect's concepts in column order.
+    """
+    return dict(dialectRegistry(DialectLocation)[Dialect])
+
+
+def _dialectConceptCounts(occurrenceMatrix, Dialect, sparse=False,
+                          DialectLocation=None):
+    """Return a concept matrix with Record and Collection first, then a
+    column for every concept of the dialect in registry order, then any
+    other concepts found in the records. Missing values, including whole
+    concepts that no record has, are filled with the dialect's value as
+    the columns are gathered, so the wide matrix is assembled only once.
+    Missing concepts of a ``sparse`` matrix become constant sparse columns.
+    The fill values come from the ``DialectLocation`` registry.
+    """
+    FILLvalues = dialectFillValues(Dialect, DialectLocation)
+    columns = {'Record': occurrenceMatrix['Record'],
+               'Collection': occurrenceMatrix['Collection']}
+    for concept, value in FILLvalues.items():
+        if concept not in occurrenceMatrix:
+            column = np.full(len(occurrenceMatrix), value)
+            if sparse:
+                column = pd.arrays.SparseArray(column, fill_value=value)
+        else:
+            column = occurrenceMatrix[concept]
+            if not sparse and column.hasnans:
+                column = column.fillna(value)
+        columns[concept] = column
+    for concept in occurrenceMatrix.columns:
+        if concept not in columns:
+            columns[concept] = occurrenceMatrix[concept]
+    return pd.DataFrame(columns, index=occurrenceMatrix.index)
+
+
+def _writeProduct(DF, DataDestination):
+    if DataDestination is not None:
+        DataDestinationDirectory = DataDestination[
+            :DataDestination.rfind('/') + 1]
+        os.makedirs(DataDestinationDirectory, exist_ok=True)
+        writeTable(DF, DataDestination)
+
+
 def conceptCounts(EvaluatedMetadataDF, Organization, Collection,
-                  Dialect, DataDestination):
+                  Dialect, DataDestination, sparse=False,
+                  DialectLocation=None):
     """requires a dataframe with concepts DF Can created by xmlEval.
-    It is required for combineConceptCounts, collectionSpreadsheet
+    It is required for combineConceptCounts, collectionSpreadsheet.
+    The dataframe may be an iterator of chunks (see ``_groupCounts``).
+    With ``sparse`` the counts stay in sparse columns and are only made
+    dense when written; pass ``DataDestination=None`` to skip writing.
+    Concepts are filled in from the ``DialectLocation`` dialect registry
+    (see ``dialectRegistry``).
     """
-    DataDestinationDirectory = DataDestination[:DataDestination.rfind('/') + 1]
-    os.makedirs(DataDestinationDirectory, exist_ok=True)
-    dialectOccurrenceDF = pd.read_csv('./dialectContains.csv')
-    dialectOccurrenceDF = (dialectOccurrenceDF[
-        dialectOccurrenceDF['Concept'] == Dialect])
-    group_name = EvaluatedMetadataDF.groupby([
-        'Collection', 'Record', 'Concept'], as_index=False)
-    occurrenceMatrix = group_name.size().unstack().reset_index()
-    occurrenceMatrix = occurrenceMatrix.fillna(0)
-    occurrenceMatrix.columns.names = ['']
-    occurrenceMatrix = pd.concat(
-        [dialectOccurrenceDF, occurrenceMatrix],
-        axis=0, ignore_index=True, #sort=True
-    )
-    mid = occurrenceMatrix['Collection']
-    mid2 = occurrenceMatrix['Record']
-    occurrenceMatrix.drop(
-        labels=['Collection', 'Record', 'Concept'], axis=1, inplace=True)
-    occurrenceMatrix.insert(0, 'Collection', mid)
-    occurrenceMatrix.insert(0, 'Record', mid2)
-
-    dialectOccurrenceDF = pd.read_csv('./dialectContains.csv')
-    dialectOccurrenceDF = (
-        dialectOccurrenceDF[dialectOccurrenceDF['Concept'] == Dialect])
-    FILLvalues = dialectOccurrenceDF.to_dict('records')
-    FILLvalues = FILLvalues[0]
-    occurrenceMatrix = occurrenceMatrix.fillna(value=FILLvalues)
-    occurrenceMatrix.reset_index()
-    occurrenceMatrix = occurrenceMatrix.drop(occurrenceMatrix.index[0])
-    occurrenceMatrix.to_csv(DataDestination, mode='w', index=False)
+    occurrenceMatrix = _countMatrix(EvaluatedMetadataDF, 'Concept', sparse)
+    occurrenceMatrix = _dialectConceptCounts(
+        occurrenceMatrix, Dialect, sparse, DialectLocation)
+    _writeProduct(occurrenceMatrix, DataDestination)
     return(occurrenceMatrix)
 
 
 def XpathCounts(EvaluatedMetadataDF, Organization, Collection, Dialect,
-                DataDestination):
+                DataDestination, sparse=False):
     """XpathCounts requires a dataframe with xpath.The DF
     can created be localAllNodesEval, XMLeval(not accurate), or
-    a simpleXpath. It is required for combineXpathCounts"""
-    DataDestinationDirectory = DataDestination[:DataDestination.rfind('/') + 1]
-    os.makedirs(DataDestinationDirectory, exist_ok=True)
-    group_name = (EvaluatedMetadataDF.groupby(
-        ['Collection', 'Record', 'XPath'], as_index=False))
-    Xpathdf = group_name.size().unstack().reset_index()
-    Xpathdf = Xpathdf.fillna(0)
+    a simpleXpath. It is required for combineXpathCounts.
+    The dataframe may be an iterator of chunks (see ``_groupCounts``).
+    With ``sparse`` the counts stay in sparse columns and are only made
+    dense when written; pass ``DataDestination=None`` to skip writing.
+    """
+    Xpathdf = _countMatrix(EvaluatedMetadataDF, 'XPath', sparse)
     pd.options.display.float_format = '{:,.0f}'.format
-    Xpathdf.to_csv(DataDestination, mode='w', index=False)
+    _writeProduct(Xpathdf, DataDestination)
     return(Xpathdf)
 
 
+def _occurrenceResult(totals, Key, Organization, Collection, Dialect):
+    """Build a concept or xpath occurrence data product from the column
+    ``totals`` of a count matrix (see ``_columnTotals``). The first row
+    holds the number of records; counts are integers and averages and
+    occurrence% are floats, left for the output layer to format.
+    """
+    keys, sums, nonzero, NumberOfRecords = totals
+    with np.errstate(divide='ignore', invalid='ignore'):
+        average = sums / NumberOfRecords
+        occurrence = nonzero / NumberOfRecords
+    # for concepts the record count row reads as 100% of the records
+    first = 1.0 if Key == 'Concept' else NumberOfRecords
+    return pd.DataFrame({
+        Key: ['Number of Records'] + list(keys),
+        'Collection': Organization + '_' + Collection,
+        Key + 'Count': np.concatenate(
+            [[NumberOfRecords], sums]).astype('int64'),
+        'RecordCount': np.concatenate(
+            [[NumberOfRecords], nonzero]).astype('int64'),
+        'AverageOccurrencePerRecord': np.concatenate(
+            [[first], average]).astype('float64'),
+        'CollectionOccurrence%': np.concatenate(
+            [[first], occurrence]).astype('float64'),
+    })
+
+
 def conceptOccurrence(EvaluatedMetadataDF, Organization,
-                      Collection, Dialect, DataDestination):
+                      Collection, Dialect, DataDestination, sparse=False):
     # concept occurrence data product
     """requires a dataframe with concepts DF.
     Can created be localKnownNodesEval,XMLeval(inaccurate), or a
     simpleXpath function/ EvaluatedDatatable. It is required
-    for combineConceptOccurrence
+    for combineConceptOccurrence. ``sparse`` counts in a sparse matrix.
+    The dataframe may be an iterator of chunks (see ``_groupCounts``).
     """
     DataDestinationDirectory = DataDestination[:DataDestination.rfind('/') + 1]
     os.makedirs(DataDestinationDirectory, exist_ok=True)
-    group_name = (EvaluatedMetadataDF.groupby(
-        ['Record', 'Concept'], as_index=False))
-    occurrenceMatrix = group_name.size().unstack().reset_index()
-    occurrenceMatrix = occurrenceMatrix.fillna(0)
-    occurrenceSum = occurrenceMatrix.sum()
-    occurrenceCount = occurrenceMatrix[occurrenceMatrix != 0].count()
-
-    result = pd.concat([occurrenceSum, occurrenceCount], axis=1).reset_index()
-    result.insert(
-        1, 'Collection', Organization + '_' + Collection
-    )
-    result.insert(4, 'CollectionOccurrence%', Collection + '_' + Dialect)
-    result.insert(4, 'AverageOccurrencePerRecord', Collection + '_' + Dialect)
-    result.columns = [
-        'Concept', 'Collection', 'ConceptCount', 'RecordCount',
-        'AverageOccurrencePerRecord', 'CollectionOccurrence%'
-    ]
-    NumberOfRecords = result.at[0, 'ConceptCount'].count('.xml')
-    result['CollectionOccurrence%'] = result['RecordCount'] / NumberOfRecords
-    result.at[0, 'ConceptCount'] = NumberOfRecords
-    result.at[0, 'Concept'] = 'Number of Records'
-    result['AverageOccurrencePerRecord'] = (
-        result['ConceptCount'] / NumberOfRecords)
-    result['AverageOccurrencePerRecord'] = (
-        result['AverageOccurrencePerRecord'].astype(float))
-    result[["ConceptCount", "RecordCount"]] = (
-        result[["ConceptCount", "RecordCount"]].astype(int))
-    result['AverageOccurrencePerRecord'] = pd.Series(
-        ["{0:.2f}".format(val) for val in result[
-            'AverageOccurrencePerRecord'
-        ]], index=result.index)
-    result.to_csv(DataDestination, mode='w', index=False)
+    occurrenceMatrix = _countMatrix(
+        EvaluatedMetadataDF, 'Concept', sparse, by=['Record'])
+    result = _occurrenceResult(_columnTotals(occurrenceMatrix), 'Concept',
+                               Organization, Collection, Dialect)
+    writeTable(result, DataDestination)
     return(result)
 
 
 def xpathOccurrence(EvaluatedMetadataDF, Organization, Collection,
-                    Dialect, DataDestination):
+                    Dialect, DataDestination, sparse=False):
     # xpath occurrence data product
     """requires a list of xpathOccurrence csv.
-    It is required for OrganizationSpreadsheet
+    It is required for OrganizationSpreadsheet.
+    ``sparse`` counts in a sparse matrix.
+    The dataframe may be an iterator of chunks (see ``_groupCounts``).
     """
     DataDestinationDirectory = DataDestination[:DataDestination.rfind('/') + 1]
     os.makedirs(DataDestinationDirectory, exist_ok=True)
-    group_name = EvaluatedMetadataDF.groupby(
-        ['Record', 'XPath'], as_index=False)
-    occurrenceMatrix = group_name.size().unstack().reset_index()
-    occurrenceMatrix = occurrenceMatrix.fillna(0)
-    occurrenceSum = occurrenceMatrix.sum()
-    occurrenceCount = occurrenceMatrix[occurrenceMatrix != 0].count()
-
-    result = pd.concat([occurrenceSum, occurrenceCount], axis=1).reset_index()
-    result.insert(
-        1, 'Collection', Organization + '_' + Collection)
-    result.insert(4, 'CollectionOccurrence%', Collection + '_' + Dialect)
-    result.insert(4, 'AverageOccurrencePerRecord', Collection + '_' + Dialect)
-    result.columns = [
-        'XPath', 'Collection', 'XPathCount', 'RecordCount',
-        'AverageOccurrencePerRecord', 'CollectionOccurrence%'
-    ]
-    NumberOfRecords = result.at[0, 'XPathCount'].count('.xml')
-    result['CollectionOccurrence%'] = result['RecordCount'] / NumberOfRecords
-    result.at[0, 'XPathCount'] = NumberOfRecords
-    result.at[0, 'XPath'] = 'Number of Records'
-    result.at[0, 'CollectionOccurrence%'] = NumberOfRecords
-    result['AverageOccurrencePerRecord'] = (
-        result['XPathCount'] / NumberOfRecords)
-    result[['AverageOccurrencePerRecord', 'CollectionOccurrence%']] = (
-        result[['AverageOccurrencePerRecord',
-                'CollectionOccurrence%']].astype(float)
-    )
-    result[["XPathCount", "RecordCount"]] = (
-        result[["XPathCount", "RecordCount"]].astype(int)
-    )
-    result['AverageOccurrencePerRecord'] = (pd.Series([
-        "{0:.2f}".format(val) for val in result['AverageOccurrencePerRecord']
-    ], index=result.index))
-    result.at[0, 'AverageOccurrencePerRecord'] = NumberOfRecords
-    result.to_csv(DataDestination, mode='w', index=False)
+    occurrenceMatrix = _countMatrix(
+        EvaluatedMetadataDF, 'XPath', sparse, by=['Record'])
+    result = _occurrenceResult(_columnTotals(occurrenceMatrix), 'XPath',
+                               Organization, Collection, Dialect)
+    writeTable(result, DataDestination)
     return(result)
 
 
+def occurrenceProducts(EvaluatedMetadataDF, Organization, Collection,
+                       Dialect, Key='XPath', CountsDestination=None,
+                       OccurrenceDestination=None, sparse=False,
+                       DialectLocation=None):
+    """Fused XpathCounts/xpathOccurrence (``Key='XPath'``) or
+    conceptCounts/conceptOccurrence (``Key='Concept'``). The evaluated
+    table is grouped once by Collection, Record and Key, and both the
+    per-record count matrix and the occurrence data product (total
+    count, record count, average occurrence per record and collection
+    occurrence%) are derived from that one aggregation. Each product is
+    written when its destination is given. Returns both dataframes.
+    The evaluated table may be an iterator of chunks. Concept counts are
+    filled in from the ``DialectLocation`` dialect registry.
+    """
+    counts = _groupCounts(
+        EvaluatedMetadataDF, ['Collection', 'Record', Key])
+    countsDF = _countFrame(counts, sparse)
+    if Key == 'Concept':
+        countsDF = _dialectConceptCounts(
+            countsDF, Dialect, sparse, DialectLocation)
+    occurrenceDF = _occurrenceResult(_groupTotals(counts), Key,
+                                     Organization, Collection, Dialect)
+    _writeProduct(countsDF, CountsDestination)
+    _writeProduct(occurrenceDF, OccurrenceDestination)
+    return countsDF, occurrenceDF
+
+
+# Incremental occurrence updates
+
+
+def _keyTotals(counts):
+    byKey = counts.groupby(level=-1, observed=True)
+    return pd.DataFrame({'Count': byKey.sum(), 'RecordCount': byKey.size()})
+
+
+# entries of a part of the per record counts of an occurrence state
+OCCURRENCE_PART_SIZE = 2 ** 16
+
+
+def _recordParts(records, parts):
+    """Return the part (0 to ``parts`` - 1) of each of ``records``, from
+    a hash of the record name that is the same in every session.
+    """
+    records = np.asarray(records, dtype=object).astype(str)
+    return (pd.util.hash_array(records) % parts).astype(int)
+
+
+def _splitCounts(counts, parts=None):
+    """Split per record ``counts`` into a dict of ``parts`` Series (by
+    default one per ``OCCURRENCE_PART_SIZE`` entries), each holding all
+    the counts of its records.
+    """
+    if parts is None:
+        parts = max(1, len(counts) // OCCURRENCE_PART_SIZE)
+    split = {part: counts.iloc[:0] for part in range(parts)}
+    codes = _recordParts(counts.index.get_level_values('Record'), parts)
+    for part, partCounts in counts.groupby(codes, sort=False):
+        # levels of the whole collection would make every update of the
+        # part as slow as one of the collection
+        partCounts.index = partCounts.index.remove_unused_levels()
+        split[int(part)] = partCounts
+    return split
+
+
+def occurrenceState(EvaluatedMetadataDF, Key='XPath'):
+    """Start an incremental occurrence state for ``Key`` (XPath or
+    Concept). The state keeps each record's count contributions, split
+    into Parts by record, the collection totals per key and the number
+    of records, so that ``updateOccurrenceState`` can apply changes as
+    deltas. The evaluated table may be an iterator of chunks.
+    """
+    counts = _groupCounts(
+        EvaluatedMetadataDF, ['Collection', 'Record', Key])
+    return {'Key': Key, 'Parts': _splitCounts(counts),
+            'Totals': _keyTotals(counts),
+            'NumberOfRecords': len(counts.index.droplevel(-1).unique())}
+
+
+def updateOccurrenceState(State, EvaluatedMetadataDF=None,
+                          RemovedRecords=()):
+    """Apply changed records to an occurrence ``State``. Records in
+    ``EvaluatedMetadataDF`` are added, or replace the earlier version of
+    the same record; records named in ``RemovedRecords`` are dropped.
+    A record evaluated again that gives no rows (one that is no longer
+    well-formed, say) is not in ``EvaluatedMetadataDF``, so it must be
+    named in ``RemovedRecords`` to drop its old counts.
+    Only the parts holding the changed records are touched and only
+    their contributions are subtracted from and added to the totals, so
+    the cost follows the churn rather than the size of the collection.
+    When the collection has grown to four times the size its parts were
+    made for, they are split again. Returns the updated state.
+    """
+    Key = State['Key']
+    parts = dict(State['Parts'])
+    if EvaluatedMetadataDF is not None:
+        new = _groupCounts(
+            EvaluatedMetadataDF, ['Collection', 'Record', Key])
+    else:
+        new = parts[0].iloc[:0]
+    newRecords = new.index.get_level_values('Record')
+    changed = sorted(set(newRecords.astype(str)) |
+                     set(str(record) for record in RemovedRecords))
+    byPart = {}
+    for record, part in zip(changed, _recordParts(changed, len(parts))):
+        byPart.setdefault(part, []).append(record)
+    newCodes = _recordParts(newRecords, len(parts))
+    olds = []
+    for part, records in byPart.items():
+        partCounts = parts[part]
+        mask = partCounts.index.get_level_values('Record').astype(
+            str).isin(records)
+        olds.append(partCounts[mask])
+        parts[part] = pd.concat([partCounts[~mask], new[newCodes == part]])
+    old = pd.concat(olds) if olds else new.iloc[:0]
+
+    delta = _keyTotals(new).sub(_keyTotals(old), fill_value=0)
+    totals = State['Totals'].add(delta, fill_value=0)
+    totals = totals[totals['RecordCount'] > 0].astype('int64')
+    NumberOfRecords = (
+        State['NumberOfRecords'] +
+        len(new.index.droplevel(-1).unique()) -
+        len(old.index.droplevel(-1).unique()))
+    if sum(map(len, parts.values())) > (
+            4 * len(parts) * OCCURRENCE_PART_SIZE):
+        parts = _splitCounts(pd.concat(list(parts.values())))
+    return {'Key': Key, 'Parts': parts, 'Totals': totals,
+            'NumberOfRecords': NumberOfRecords}
+
+
+def stateOccurrence(State, Organization, Collection, Dialect,
+                    DataDestination=None):
+    """The xpath or concept occurrence data product of an occurrence
+    ``State``, the same as xpathOccurrence/conceptOccurrence would give
+    for all of its records, computed from the totals alone.
+    """
+    totals = State['Totals']
+    result = _occurrenceResult(
+        (totals.index, totals['Count'].to_numpy(),
+         totals['RecordCount'].to_numpy(), State['NumberOfRecords']),
+        State['Key'], Organization, Collection, Dialect)
+    _writeProduct(result, DataDestination)
+    return result
+
+
+def stateCounts(State, Dialect, DataDestination=None, sparse=False,
+                DialectLocation=None):
+    """The XpathCounts or conceptCounts matrix of an occurrence
+    ``State``, concepts filled in from the ``DialectLocation`` registry.
+    """
+    # regroup to get the sorted index a fresh groupby would have
+    counts = pd.concat(list(State['Parts'].values())).groupby(
+        level=[0, 1, 2], observed=True).sum()
+    countsDF = _countFrame(counts, sparse)
+    if State['Key'] == 'Concept':
+        countsDF = _dialectConceptCounts(
+            countsDF, Dialect, sparse, DialectLocation)
+    _writeProduct(countsDF, DataDestination)
+    return countsDF
+
+
+def saveOccurrenceState(State, StateLocation):
+    """Save an occurrence ``State`` to the ``StateLocation`` directory."""
+    os.makedirs(StateLocation, exist_ok=True)
+    counts = pd.concat(list(State['Parts'].values()))
+    counts = counts.rename('Count').reset_index()
+    writeTable(counts, os.path.join(StateLocation, 'counts.parquet'))
+    writeTable(State['Totals'].rename_axis(State['Key']).reset_index(),
+               os.path.join(StateLocation, 'totals.parquet'))
+    with open(os.path.join(StateLocation, 'state.json'), 'w') as f:
+        json.dump({'Key': State['Key'],
+                   'NumberOfRecords': int(State['NumberOfRecords'])}, f)
+
+
+def loadOccurrenceState(StateLocation):
+    """Load an occurrence state saved by ``saveOccurrenceState``."""
+    with open(os.path.join(StateLocation, 'state.json')) as f:
+        State = json.load(f)
+    Key = State['Key']
+    counts = readTable(os.path.join(StateLocation, 'counts.parquet'))
+    for column in ('Collection', 'Record', Key):
+        counts[column] = counts[column].astype(str)
+    State['Parts'] = _splitCounts(counts.set_index(
+        ['Collection', 'Record', Key])['Count'])
+    totals = readTable(os.path.join(StateLocation, 'totals.parquet'))
+    totals[Key] = totals[Key].astype(str)
+    State['Totals'] = totals.set_index(Key)
+    return State
+
+
 def CombineConceptOccurrence(CollectionComparisons, DataDestination):
     """Using concept occurrence data products, combine them and produce a
     collection occurrence% table with collections for columns and concepts
@@ -292,7 +1470,7 @@ def CombineConceptOccurrence(CollectionComparisons, DataDestination):
     """
     DataDestinationDirectory = DataDestination[:DataDestination.rfind('/') + 1]
     os.makedirs(DataDestinationDirectory, exist_ok=True)
-    CombinedDF = pd.concat((pd.read_csv(f) for f in CollectionComparisons))
+    CombinedDF = pd.concat((readTable(f) for f in CollectionComparisons))
     CombinedDF = CombinedDF.reset_index()
     CombinedPivotDF = CombinedDF.pivot_table(
         index='Concept', columns='Collection', values='CollectionOccurrence%')
@@ -300,7 +1478,7 @@ def CombineConceptOccurrence(CollectionComparisons, DataDestination):
     ConceptCountsDF = CombinedPivotDF.fillna(0)
     ConceptCountsDF.columns.names = ['']
     ConceptCountsDF = ConceptCountsDF.reset_index()
-    ConceptCountsDF.to_csv(DataDestination, mode='w', index=False)
+    writeTable(ConceptCountsDF, DataDestination)
     return ConceptCountsDF
 
 
@@ -312,8 +1490,8 @@ def CombineConceptCounts(CollectionComparisons, DataDestination):
     """
     DataDestinationDirectory = DataDestination[:DataDestination.rfind('/') + 1]
     os.makedirs(DataDestinationDirectory, exist_ok=True)
-    CombinedDF = pd.concat((pd.read_csv(f) for f in CollectionComparisons))
-    CombinedDF.to_csv(DataDestination, mode='w', index=False)
+    CombinedDF = pd.concat((readTable(f) for f in CollectionComparisons))
+    writeTable(CombinedDF, DataDestination)
     return CombinedDF
 
 
@@ -325,27 +1503,38 @@ def CombineXPathOccurrence(CollectionComparisons, DataDestination):
     """
     DataDestinationDirectory = DataDestination[:DataDestination.rfind('/') + 1]
     os.makedirs(DataDestinationDirectory, exist_ok=True)
-    CombinedDF = pd.concat((pd.read_csv(f) for f in CollectionComparisons))
+    CombinedDF = pd.concat((readTable(f) for f in CollectionComparisons))
     CombinedPivotDF = CombinedDF.pivot(
         index='XPath', columns='Collection', values='CollectionOccurrence%')
 
     ConceptCountsDF = CombinedPivotDF.fillna(0)
     ConceptCountsDF.columns.names = ['']
     ConceptCountsDF = ConceptCountsDF.reset_index()
-    ConceptCountsDF.to_csv(DataDestination, mode='w', index=False)
+    writeTable(ConceptCountsDF, DataDestination)
     return ConceptCountsDF
 
 
-def CombineXPathCounts(CollectionComparisons, DataDestination):
+def CombineXPathCounts(CollectionComparisons, DataDestination,
+                       sparse=False):
     """Using xpath occurrence data products, combine them and produce a
     record count table with collections for columns and concepts for rows
     requires a list of xpath counts csv. It is required for
-    OrganizationSpreadsheet
+    OrganizationSpreadsheet. With ``sparse`` only the non-zero counts of
+    each table are kept and combined into sparse columns.
     """
     DataDestinationDirectory = DataDestination[:DataDestination.rfind('/') + 1]
     os.makedirs(DataDestinationDirectory, exist_ok=True)
+    if sparse:
+        counts = []
+        for f in CollectionComparisons:
+            stacked = readTable(f).set_index(
+                ['Collection', 'Record']).fillna(0).stack()
+            counts.append(stacked[stacked != 0])
+        CombinedXPathCountsDF = _countFrame(pd.concat(counts), sparse=True)
+        writeTable(CombinedXPathCountsDF, DataDestination)
+        return CombinedXPathCountsDF
     XPathCountCombinedDF = pd.concat(
-        (pd.read_csv(f) for f in CollectionComparisons),
+        (readTable(f) for f in CollectionComparisons),
         axis=0, ignore_index=True)
     XPathCountCombinedDF = XPathCountCombinedDF.fillna(0)
     XPathCountCombinedDF.columns.names = ['']
@@ -362,7 +1551,7 @@ def CombineXPathCounts(CollectionComparisons, DataDestination):
     CombinedXPathCountsDF = CombinedXPathCountsDF.loc[:, cols2]
     CombinedXPathCountsDF
 
-    CombinedXPathCountsDF.to_csv(DataDestination, mode='w', index=False)
+    writeTable(CombinedXPathCountsDF, DataDestination)
     return CombinedXPathCountsDF
 
 
@@ -374,9 +1563,8 @@ def CombineEvaluatedMetadata(CollectionComparisons, DataDestination):
     """
     DataDestinationDirectory = DataDestination[:DataDestination.rfind('/') + 1]
     os.makedirs(DataDestinationDirectory, exist_ok=True)
-    CombinedDF = pd.concat((pd.read_csv(f) for f in CollectionComparisons))
-    CombinedDF.to_csv(
-        DataDestination, mode='w', compression='gzip', index=False)
+    CombinedDF = pd.concat((readTable(f) for f in CollectionComparisons))
+    writeTable(CombinedDF, DataDestination, compression='gzip')
     return CombinedDF
 
 
@@ -388,7 +1576,7 @@ def CombineAverageConceptOccurrencePerRecord(
     """
     DataDestinationDirectory = DataDestination[:DataDestination.rfind('/') + 1]
     os.makedirs(DataDestinationDirectory, exist_ok=True)
-    CombinedDF = pd.concat((pd.read_csv(f) for f in CollectionComparisons))
+    CombinedDF = pd.concat((readTable(f) for f in CollectionComparisons))
     CombinedDF = CombinedDF.reset_index()
     RecordCountCombinedPivotDF = CombinedDF.pivot(
         index='Concept', columns='Collection',
@@ -400,7 +1588,7 @@ def CombineAverageConceptOccurrencePerRecord(
     RecordCountCombinedPivotDF = RecordCountCombinedPivotDF.fillna(0)
     RecordCountCombinedPivotDF.columns.names = ['']
     RecordCountCombinedPivotDF = RecordCountCombinedPivotDF.reset_index()
-    RecordCountCombinedPivotDF.to_csv(DataDestination, mode='w', index=False)
+    writeTable(RecordCountCombinedPivotDF, DataDestination)
     return RecordCountCombinedPivotDF
 
 
@@ -412,7 +1600,7 @@ def CombineAverageXPathOccurrencePerRecord(
     """
     DataDestinationDirectory = DataDestination[:DataDestination.rfind('/') + 1]
     os.makedirs(DataDestinationDirectory, exist_ok=True)
-    CombinedDF = pd.concat((pd.read_csv(f) for f in CollectionComparisons))
+    CombinedDF = pd.concat((readTable(f) for f in CollectionComparisons))
     CombinedPivotDF = CombinedDF.pivot(
         index='XPath', columns='Collection',
         values='AverageOccurrencePerRecord')
@@ -422,223 +1610,439 @@ def CombineAverageXPathOccurrencePerRecord(
     ConceptCountsDF.columns.names = ['']
     ConceptCountsDF = ConceptCountsDF.reset_index()
 
-    ConceptCountsDF.to_csv(DataDestination, mode='w', index=False)
+    writeTable(ConceptCountsDF, DataDestination)
     return ConceptCountsDF
 
 
-def collectionSpreadsheet(Organization, Collection, Dialect,
-                          EvaluatedConcepts, EvaluatedXpaths,
-                          xpathOccurrence, xpathCounts,
-                          conceptOccurrence, conceptCounts,
-                          DataDestination):
-    # create spreadsheet for an collection
-    """requires xpath and concept occurrence,
-    as well as the concept counts csv for a collection
+def _sheetFrame(Table):
+    """Return ``Table`` if it is a dataframe, otherwise read it from a
+    parquet file or, as text cells like the csv it came from, from a csv.
+    """
+    if isinstance(Table, pd.DataFrame):
+        return Table
+    if Table.endswith('.parquet'):
+        return readTable(Table)
+    return pd.read_csv(Table, dtype=str, keep_default_na=False)
+
+
+def _frameRows(DF, chunksize=10000, header=True):
+    """Yield the header (unless ``header`` is false) and then the rows of
+    ``DF`` as lists of python values, with missing values as None,
+    ``chunksize`` rows at a time.
+    """
+    if header:
+        yield [str(column) for column in DF.columns]
+    for start in range(0, len(DF), chunksize):
+        chunk = DF.iloc[start:start + chunksize]
+        values = np.empty(chunk.shape, dtype=object)
+        for col in range(chunk.shape[1]):
+            values[:, col] = chunk.iloc[:, col].to_numpy(dtype=object)
+        values[pd.isna(values)] = None
+        yield from values.tolist()
+
+
+def _trafficLights(worksheet, first_row, first_col, last_row, last_col,
+                   formatGreen, formatYellow, formatRed):
+    """Colour cells of at least 1 green, 0 yellow and -1 red."""
+    for criteria, value, cell_format in (('>=', 1, formatGreen),
+                                         ('=', 0, formatYellow),
+                                         ('=', -1, formatRed)):
+        worksheet.conditional_format(
+            first_row, first_col, last_row, last_col,
+            {'type': 'cell', 'criteria': criteria, 'value': value,
+             'format': cell_format})
+
+
+# background and font colours of the traffic light classes
+LIGHT_COLOURS = {'green': ('#C6EFCE', '#006100'),
+                 'yellow': ('#FFEB9C', '#9C6500'),
+                 'red': ('#FFC7CE', '#9C0006')}
+
+
+def _lightFormats(workbook):
+    """Return the green, yellow and red cell formats of ``workbook``."""
+    return tuple(workbook.add_format({'bg_color': bg_color,
+                                      'font_color': font_color})
+                 for bg_color, font_color in LIGHT_COLOURS.values())
+
+
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_COLS = 16384
+
+
+def _checkSheetSize(name, rows, cols):
+    if rows > EXCEL_MAX_ROWS or cols > EXCEL_MAX_COLS:
+        raise ValueError(
+            '{} needs {} rows and {} columns, more than the {} rows and {} '
+            'columns of a worksheet'.format(
+                name, rows, cols, EXCEL_MAX_ROWS, EXCEL_MAX_COLS))
+
+
+def _sheetParts(name, DF, idColumns=()):
+    """Plan how ``DF`` fits into worksheets within Excel's limits. A
+    counts matrix (with ``idColumns``) too wide for a sheet is turned on
+    its side: a header row of ``idColumns[0]``, a row for each other id
+    column, then one row per key and a column per record. Rows beyond a
+    sheet go to continuation sheets, 'name (2)' and so on, that repeat the
+    header rows. Returns a list of dicts with the sheet Name, its Header
+    rows, its Body frame (for a transposed sheet, the keys whose columns
+    of ``DF`` become its rows), the Offset of the body, whether it is
+    Transposed and the Frame ``DF`` itself. Raises ValueError when ``DF``
+    cannot fit even so, before anything is written.
     """
+    header = [[str(column) for column in DF.columns]]
+    body = DF
+    transposed = DF.shape[1] > EXCEL_MAX_COLS and bool(idColumns)
+    if transposed:
+        keys = [column for column in DF.columns if column not in idColumns]
+        header = [[str(column)] + DF[column].tolist()
+                  for column in idColumns]
+        # the rows are made from the key columns as they are written
+        body = keys
+    _checkSheetSize(name, len(header) + 1, len(header[0]))
+    perSheet = EXCEL_MAX_ROWS - len(header)
+    parts = []
+    for part, start in enumerate(range(0, max(len(body), 1), perSheet)):
+        # worksheet names are at most 31 characters
+        suffix = ' ({})'.format(part + 1) if part else ''
+        sheetName = name[:31 - len(suffix)] + suffix
+        parts.append({'Name': sheetName, 'Header': header,
+                      'Body': (body[start:start + perSheet] if transposed
+                               else body.iloc[start:start + perSheet]),
+                      'Offset': start, 'Transposed': transposed,
+                      'Frame': DF})
+    return parts
+
+
+def _keyRows(DF, keys):
+    """Yield a row for each of ``keys``: the key and then its column of
+    ``DF``, with missing values as None.
+    """
+    for key in keys:
+        values = DF[key].to_numpy(dtype=object)
+        values[pd.isna(values)] = None
+        yield [str(key)] + values.tolist()
+
+
+def _writeParts(workbook, parts, widths=(), filterCol=None, lights=None,
+                lightFormats=(), cell_format=None):
+    """Write the sheets planned by ``_sheetParts``, each with the column
+    ``widths`` ((first, last or None for the last column, width[,
+    format]) tuples), an autofilter up to ``filterCol`` (default the last
+    column) and, with ``lights`` (first row, first column, last column or
+    None), the green, yellow and red ``lightFormats``. A transposed sheet
+    is coloured from its first key row and second column. Every cell is
+    written with ``cell_format``.
+    """
+    for part in parts:
+        worksheet = workbook.add_worksheet(part['Name'])
+        lastCol = len(part['Header'][0]) - 1
+        for first, last, *column_format in widths:
+            worksheet.set_column(first, lastCol if last is None else last,
+                                 *column_format)
+        row_count = 0
+        for row in part['Header']:
+            worksheet.write_row(row_count, 0, row, cell_format)
+            row_count += 1
+        if part['Transposed']:
+            rows = _keyRows(part['Frame'], part['Body'])
+        else:
+            rows = _frameRows(part['Body'], header=False)
+        for row in rows:
+            worksheet.write_row(row_count, 0, row, cell_format)
+            row_count += 1
+        worksheet.autofilter(0, 0, row_count - 1,
+                             lastCol if filterCol is None else filterCol)
+        if lights is not None:
+            first_row, first_col, last_col = lights
+            if part['Transposed']:
+                first_row, first_col, last_col = len(part['Header']), 1, None
+            first_row = max(first_row - part['Offset'], len(part['Header']))
+            _trafficLights(worksheet, first_row, first_col, row_count - 1,
+                           lastCol if last_col is None else last_col,
+                           *lightFormats)
+
+
+def collectionWorkbook(Organization, Collection, Dialect,
+                       EvaluatedConcepts, EvaluatedXpaths,
+                       xpathOccurrence, xpathCounts,
+                       conceptOccurrence, conceptCounts,
+                       DataDestination):
+    """Write the collection spreadsheet straight from the dataframes
+    returned by the evaluation, counts and occurrence functions. The
+    workbook is written in xlsxwriter's constant_memory mode, a row at a
+    time, and sheet dimensions come from the frame shapes. Tables longer
+    than a worksheet continue on further sheets and counts matrices wider
+    than one are transposed (see ``_sheetParts``); this is all planned,
+    and anything that cannot fit reported, before the workbook is written.
+    """
+    sheets = [
+        _sheetParts('ConceptOccurrence', conceptOccurrence),
+        _sheetParts('ConceptCounts', conceptCounts, ['Record', 'Collection']),
+        _sheetParts('ConceptContent', EvaluatedConcepts),
+        _sheetParts('XpathOccurrence', xpathOccurrence),
+        _sheetParts('XpathCounts', xpathCounts, ['Record', 'Collection']),
+        _sheetParts('XpathContent', EvaluatedXpaths)]
+
     workbook = xlsxwriter.Workbook(
         DataDestination,
-        {'strings_to_numbers': True, 'strings_to_urls': False})
+        {'constant_memory': True, 'strings_to_numbers': True,
+         'strings_to_urls': False})
     cell_format11 = workbook.add_format()
     cell_format11.set_num_format('0%')
-    cell_format04 = workbook.add_format()
-    cell_format04.set_num_format('0')
     cell_format05 = workbook.add_format()
     cell_format05.set_num_format('0.00')
-    formatGreen = workbook.add_format({'bg_color': '#C6EFCE',
-                                       'font_color': '#006100'})
-    formatRed = workbook.add_format({'bg_color': '#FFC7CE',
-                                     'font_color': '#9C0006'})
-    formatYellow = workbook.add_format({'bg_color': '#FFEB9C',
-                                        'font_color': '#9C6500'})
-    ConceptOccurrence = workbook.add_worksheet('ConceptOccurrence')
-    ConceptCounts = workbook.add_worksheet('ConceptCounts')
-    ConceptContent = workbook.add_worksheet('ConceptContent')
-    XpathOccurrence = workbook.add_worksheet('XpathOccurrence')
-    XpathOccurrence.set_column('A:A', 100)
-    XpathOccurrence.set_column('C:D', 20)
-    XpathOccurrence.set_column('E:E', 30)
-    XpathOccurrence.set_column('F:F', 25, cell_format11)
-    XpathOccurrence.set_column('B:B', 30)
-    ConceptOccurrence.set_column('B:B', 25)
-    ConceptOccurrence.set_column('C:D', 15)
-    ConceptOccurrence.set_column('E:E', 30)
-    ConceptOccurrence.set_column('F:F', 25, cell_format11)
-    ConceptOccurrence.set_column('A:A', 30)
-    ConceptCounts.set_column('A:OD', 20)
-    XpathCounts = workbook.add_worksheet('XpathCounts')
-    XpathCounts.set_column('A:OD', 30)
-    XpathContent = workbook.add_worksheet('XpathContent')
-    XpathContent.set_column('A:B', 30)
-    XpathContent.set_column('C:C', 100)
-    XpathContent.set_column('D:D', 20)
-    ConceptContent.set_column('A:C', 25)
-    ConceptContent.set_column('D:D', 30)
-    ConceptContent.set_column('E:E', 70)
-    ConceptContent.set_column('F:F', 20)
-
-    Reader = csv.reader(open(EvaluatedXpaths), delimiter=',', quotechar='"')
-    row_count = 0
-
-    for row in Reader:
-        for col in range(len(row)):
-            XpathContent.write(row_count, col, row[col])
-        row_count += 1
-    Reader = csv.reader(open(EvaluatedXpaths), delimiter=',', quotechar='"')
-    row_count = 0
-
-    absRowCount = sum(1 for row in Reader)
-    XpathContent.autofilter(0, 0, absRowCount - 1, 3)
-    Reader = csv.reader(open(EvaluatedConcepts), delimiter=',', quotechar='"')
-    row_count = 0
-
-    for row in Reader:
-        for col in range(len(row)):
-            ConceptContent.write(row_count, col, row[col])
-        row_count += 1
-    Reader = csv.reader(open(EvaluatedConcepts), delimiter=',', quotechar='"')
-    row_count = 0
-    absRowCount = sum(1 for row in Reader)
-
-    ConceptContent.autofilter(0, 0, absRowCount - 1, 5)
-    # create a worksheet from the concept occurrence csv
-    Reader = csv.reader(open(
-        conceptOccurrence, 'r'), delimiter=',', quotechar='"')
-    row_count = 0
-
-    for row in Reader:
-        for col in range(len(row)):
-            ConceptOccurrence.write(row_count, col, row[col])
-        row_count += 1
-    Reader = csv.reader(open(
-        conceptOccurrence, 'r'), delimiter=',', quotechar='"')
-    absRowCount = sum(1 for row in Reader)
-    absColCount = len(next(csv.reader(
-        open(conceptOccurrence, 'r'), delimiter=',', quotechar='"'
-    )))
-    ConceptOccurrence.autofilter(0, 0, absRowCount - 1, absColCount - 1)
-    ConceptOccurrence.conditional_format(
-        2, 5, absRowCount - 1, 5,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen})
-
-    ConceptOccurrence.conditional_format(
-        2, 5, absRowCount - 1, 5,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed})
-    ConceptOccurrence.conditional_format(
-        2, 5, absRowCount - 1, 5,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow})
-    Reader = csv.reader(open(
-        xpathOccurrence, 'r'), delimiter=',', quotechar='"')
-
-    row_count = 0
-    Reader = csv.reader(open(
-        conceptCounts, 'r'), delimiter=',', quotechar='"')
-    row_count = 0
-
-    for row in Reader:
-        for col in range(len(row)):
-            ConceptCounts.write(row_count, col, row[col])
-
-        row_count += 1
-
-    Reader = csv.reader(open(
-        xpathOccurrence, 'r'), delimiter=',', quotechar='"')
-    row_count = 0
-    for row in Reader:
-        for col in range(len(row)):
-            XpathOccurrence.write(row_count, col, row[col])
-        row_count += 1
-    Reader = csv.reader(open(
-        xpathOccurrence, 'r'), delimiter=',', quotechar='"')
-    absRowCount = sum(1 for row in Reader)
-    absColCount = len(next(csv.reader(
-        open(xpathOccurrence, 'r'), delimiter=',', quotechar='"'
-    )))
-    XpathOccurrence.autofilter(0, 0, absRowCount - 1, 5)
-    XpathOccurrence.conditional_format(
-        2, 5, absRowCount - 1, 5,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen})
-
-    XpathOccurrence.conditional_format(
-        2, 5, absRowCount - 1, 5,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow})
-
-    XpathOccurrence.conditional_format(
-        2, 5, absRowCount - 1, 5,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed})
-
-    Reader = csv.reader(open(
-        conceptCounts, 'r'), delimiter=',', quotechar='"'
-    )
-    absRowCount = sum(1 for row in Reader)
-    absColCount = len(next(csv.reader(
-        open(conceptCounts, 'r'), delimiter=',', quotechar='"'
-    )))
-    ConceptCounts.autofilter(0, 0, absRowCount - 1, absColCount - 1)
-    ConceptCounts.conditional_format(
-        1, 2, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen})
-
-    ConceptCounts.conditional_format(
-        1, 2, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow})
-    ConceptCounts.conditional_format(
-        1, 2, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed})
-
-    Reader = csv.reader(open(
-        xpathCounts, 'r'), delimiter=',', quotechar='"'
-    )
-    absRowCount = sum(1 for row in Reader)
-    absColCount = len(next(csv.reader(
-        open(xpathCounts, 'r'), delimiter=',', quotechar='"'
-    )))
-    XpathCounts.autofilter(0, 0, absRowCount - 1, absColCount - 1)
-    XpathCounts.conditional_format(
-        1, 2, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen})
-
-    XpathCounts.conditional_format(
-        1, 2, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow})
-    XpathCounts.conditional_format(
-        1, 2, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed})
-
-    Reader = csv.reader(open(
-        xpathCounts, 'r'), delimiter=',', quotechar='"')
-    row_count = 0
-
-    for row in Reader:
-        for col in range(len(row)):
-            XpathCounts.write(row_count, col, row[col])
-
-        row_count += 1
+    layouts = [
+        {'widths': [(0, 0, 30), (1, 1, 25), (2, 3, 15),
+                    (4, 4, 30, cell_format05), (5, 5, 25, cell_format11)],
+         'lights': (2, 5, 5)},
+        {'widths': [(0, None, 20)], 'lights': (1, 2, None)},
+        {'widths': [(0, 2, 25), (3, 3, 30), (4, 4, 70), (5, 5, 20)],
+         'filterCol': 5},
+        {'widths': [(0, 0, 100), (1, 1, 30), (2, 3, 20),
+                    (4, 4, 30, cell_format05), (5, 5, 25, cell_format11)],
+         'filterCol': 5, 'lights': (2, 5, 5)},
+        {'widths': [(0, None, 30)], 'lights': (1, 2, None)},
+        {'widths': [(0, 1, 30), (2, 2, 100), (3, 3, 20)], 'filterCol': 3}]
+    lightFormats = _lightFormats(workbook)
+    for parts, layout in zip(sheets, layouts):
+        _writeParts(workbook, parts, lightFormats=lightFormats, **layout)
 
     workbook.close()
 
 
-def OrganizationSpreadsheet(Organization, xpathOccurrence,
-                            AVGxpathOccurrence, conceptOccurrence,
-                            AVGconceptOccurrence,
-                            ConceptCounts=None, xpathCounts=None):
-    # create spreadsheet for an organization
-    """requires each xpath and concept occurrence,
-    csv for a organization
-    (or any group of collections you want to compare)
+def collectionSpreadsheet(Organization, Collection, Dialect,
+                          EvaluatedConcepts, EvaluatedXpaths,
+                          xpathOccurrence, xpathCounts,
+                          conceptOccurrence, conceptCounts,
+                          DataDestination):
+    # create spreadsheet for an collection
+    """requires xpath and concept occurrence,
+    as well as the concept counts csv for a collection.
+    Each input may be a path or a dataframe; every file is read once and
+    the workbook is written by ``collectionWorkbook``.
+    """
+    collectionWorkbook(
+        Organization, Collection, Dialect,
+        _sheetFrame(EvaluatedConcepts), _sheetFrame(EvaluatedXpaths),
+        _sheetFrame(xpathOccurrence), _sheetFrame(xpathCounts),
+        _sheetFrame(conceptOccurrence), _sheetFrame(conceptCounts),
+        DataDestination)
+
+
+def _analysisFormulas(worksheet, Sheet, nCols, lastRow, lastCol, vlookup,
+                      cell_format11):
+    """Write rows 1 to 10 of an analysis sheet, the formulas for the
+    first ``nCols`` collections of the ``Sheet`` occurrence sheet (rows 2
+    to ``lastRow`` + 1), a whole row at a time from columns F onwards.
     """
+    cols = range(nCols)
+    cell2s = [Sheet + '!' + xlsxwriter.utility.xl_rowcol_to_cell(0, col + 1)
+              for col in cols]
+    cell3s = [xlsxwriter.utility.xl_rowcol_to_cell(2, col + 5)
+              for col in cols]
+    colRanges = [Sheet + '!' + xlsxwriter.utility.xl_range(
+        1, col + 1, lastRow, col + 1) for col in cols]
+    colRange2 = xlsxwriter.utility.xl_range(2, 5, 2, lastCol)
+    rows = [
+        (['=' + cell2 for cell2 in cell2s], None),
+        ([vlookup + str(col + 2) + ')' for col in cols], None),
+        (['=COUNTIF(' + colRange + ',">"&0)' for colRange in colRanges],
+         None),
+        (['=' + cell3 + '/COUNTA(' + colRange + ')'
+          for cell3, colRange in zip(cell3s, colRanges)], cell_format11),
+        (['=SUM(' + colRange + ')/' + cell3
+          for cell3, colRange in zip(cell3s, colRanges)], cell_format11),
+        (['=' + cell3 + '/MAX(' + colRange2 + ')' for cell3 in cell3s],
+         cell_format11),
+        (['=COUNTIF(' + colRange + ',">="&1)/' + cell3
+          for cell3, colRange in zip(cell3s, colRanges)], cell_format11),
+        (['=COUNTIFS(' + colRange + ',">"&0,' + colRange + ',"<"&1)/' +
+          cell3 for cell3, colRange in zip(cell3s, colRanges)],
+         cell_format11),
+        (['=LEFT(RIGHT(' + cell2 + ',LEN(' + cell2 + ')-FIND("_", ' +
+          cell2 + ')),FIND("_",' + cell2 + '))' for cell2 in cell2s], None),
+        (['=LEFT(' + cell2 + ',FIND("_",' + cell2 + ')-1)'
+          for cell2 in cell2s], None)]
+    for row, (formulas, cell_format) in enumerate(rows):
+        worksheet.write_row(row, 5, formulas, cell_format)
+
+
+def _analysisSummary(worksheet, lastCol, cell_format04, cell_format11):
+    """Write the MIN, MAX and AVERAGE formulas of rows 2 to 8 of an
+    analysis sheet, over the collections in columns F to ``lastCol``.
+    """
+    for row in range(1, 8):
+        colRange4 = xlsxwriter.utility.xl_range(row, 5, row, lastCol)
+        worksheet.write_row(
+            row, 2, ['=MIN(' + colRange4 + ')', '=MAX(' + colRange4 + ')',
+                     '=AVERAGE(' + colRange4 + ')'],
+            cell_format04 if row < 3 else cell_format11)
 
-    if ConceptCounts is not None and xpathCounts is not None:
-        os.makedirs('../../reports/' + Organization, exist_ok=True)
-        workbook = xlsxwriter.Workbook(
-            '../../reports/' + Organization + '/' + Organization +
-            '_Report.xlsx',
-            {'strings_to_numbers': True})
-    else:
-        os.makedirs('../reports/' + Organization, exist_ok=True)
-        workbook = xlsxwriter.Workbook(
-            '../reports/' + Organization + '/' + Organization +
-            '_Report.xlsx',
-            {'strings_to_numbers': True})
+
+def _collectionTallies(worksheet, first_row, last_row, last_col):
+    """Write the per-row count of collections with an occurrence above
+    0, equal to 1 and below 1 in columns C, D and E.
+    """
+    colRange5s = [xlsxwriter.utility.xl_range(row, 5, row, last_col)
+                  for row in range(first_row, last_row)]
+    for col, criteria in ((2, '">"&0'), (3, '"="&1'), (4, '"<"&1')):
+        worksheet.write_column(
+            first_row, col,
+            ['=COUNTIF(' + colRange5 + ',' + criteria + ')'
+             for colRange5 in colRange5s])
+
+
+def _cellValues(values):
+    """Return ``values`` as a list of floats, with None where the
+    spreadsheet formula would give an error.
+    """
+    return [float(value) if np.isfinite(value) else None
+            for value in np.asarray(values, dtype=float)]
+
+
+def _occurrenceMetrics(Occurrence, AVGxpathOccurrence):
+    """Compute with NumPy what the analysis formulas give for the
+    collections (the columns after the first) of ``Occurrence``. Returns
+    the ten rows of the formula block, the MIN, MAX and AVERAGE of rows 2
+    to 8, and for every row of ``Occurrence`` the number of collections
+    with an occurrence above 0, equal to 1 and below 1.
+    """
+    data = Occurrence.iloc[:, 1:]
+    values = data.apply(
+        lambda column: pd.to_numeric(column, errors='coerce')
+    ).to_numpy(dtype=float)
+    filled = data.notna().to_numpy() & (data.astype(str).to_numpy() != '')
+    nCols = data.shape[1]
+
+    recordsRow = AVGxpathOccurrence[
+        AVGxpathOccurrence.iloc[:, 0].astype(str) == 'Number of Records']
+    records = np.full(nCols, np.nan)
+    if len(recordsRow):
+        found = pd.to_numeric(recordsRow.iloc[0, 1:], errors='coerce')
+        found = found.to_numpy(dtype=float)[:nCols]
+        records[:len(found)] = found
+
+    positive = (values > 0).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        metrics = [
+            records,
+            positive,
+            positive / filled.sum(axis=0),
+            np.nansum(values, axis=0) / positive,
+            positive / (positive.max() if nCols else 1),
+            (values >= 1).sum(axis=0) / positive,
+            ((values > 0) & (values < 1)).sum(axis=0) / positive]
+    summary = []
+    for metric in metrics:
+        finite = metric[np.isfinite(metric)]
+        summary.append(_cellValues(
+            [finite.min(), finite.max(), finite.mean()] if finite.size
+            else [np.nan] * 3))
+
+    names = [str(name) for name in data.columns]
+    dates, collections = [], []
+    for name in names:
+        p = name.find('_') + 1
+        dates.append(name[p:][:p] if p else None)
+        collections.append(name[:p - 1] if p else None)
+    rows = [names] + [_cellValues(metric) for metric in metrics] + [
+        dates, collections]
+    tallies = np.column_stack([(values > 0).sum(axis=1),
+                               (values == 1).sum(axis=1),
+                               (values < 1).sum(axis=1)])
+    return rows, summary, tallies.tolist()
+
+
+def _analysisValues(worksheet, Occurrence, AVGxpathOccurrence,
+                    cell_format04, cell_format11):
+    """Write the precomputed ``_occurrenceMetrics`` of ``Occurrence`` to
+    an analysis sheet where the formulas would otherwise go.
+    """
+    rows, summary, tallies = _occurrenceMetrics(
+        Occurrence, AVGxpathOccurrence)
+    for row, values in enumerate(rows):
+        worksheet.write_row(row, 5, values,
+                            cell_format11 if 3 <= row < 8 else None)
+    for row, values in enumerate(summary, 1):
+        worksheet.write_row(row, 2, values,
+                            cell_format04 if row < 3 else cell_format11)
+    for row, values in enumerate(tallies, 10):
+        worksheet.write_row(row, 2, values)
+
+
+def _analysisLabels(worksheet, labels):
+    """Write the row labels and column headings of an analysis sheet."""
+    worksheet.write_column(1, 0, labels)
+    worksheet.write_row(0, 1, ['Formulas', 'MIN', 'MAX', 'AVG'])
+    worksheet.write_row(9, 2, ['#Collections', '# = 100%', '# >= 100%'])
+
+
+XPATH_ANALYSIS_LABELS = [
+    'Number of Records',
+    'Number of Elements / Attributes',
+    'Coverage w/r to Repository (CR): \
+     number of elements / total number of elements',
+    'Average Occurrence Rate',
+    'Repository Completeness: Number of elements \
+    / number of elements in most complete collection in repository',
+    'Homogeneity: Number >= 1 \
+    / Total Number of elements in the collection',
+    'Partial Elements: Number < 0 and < 1',
+    'Retrieval Date']
+CONCEPT_ANALYSIS_LABELS = [
+    'Number of Records',
+    'Number of Concepts',
+    'Coverage w/r to Repository (CR): \
+    number of concepts / total number of concepts',
+    'Average Occurrence Rate',
+    'Repository Completeness:\
+    Number of concepts / number of concepts\
+    in most complete collection in repository',
+    'Homogeneity: Number >= 1 /\
+     Total Number of concepts in the collection',
+    'Partial Concepts: Number < 0 and < 1',
+    'Retrieval Date']
+
+
+def organizationWorkbook(Organization, xpathOccurrence,
+                         AVGxpathOccurrence, conceptOccurrence,
+                         AVGconceptOccurrence, DataDestination,
+                         ConceptCounts=None, xpathCounts=None,
+                         formulas=False):
+    """Write the organization spreadsheet of ``OrganizationSpreadsheet``
+    from in-memory pivot tables. Data is written a whole row or column
+    at a time. The analysis sheets hold values computed with NumPy
+    (see ``_occurrenceMetrics``); with ``formulas`` they hold the live
+    COUNTIF/VLOOKUP formulas instead, generated a row at a time for all
+    collections. Both cover every row and collection of the tables.
+    Counts sheets beyond Excel's limits are split or transposed like the
+    collection workbook's; the other sheets refer to each other by name,
+    so a table too large for them raises ValueError before writing.
+    """
+    # the analysis and occurrence sheets refer to each other by name, so
+    # they are checked against the worksheet limits rather than split
+    xpathData = xpathOccurrence.iloc[:max(len(xpathOccurrence) - 1, 0)]
+    for name, rows, cols in (
+            ('XpathOccurrenceAnalysis', len(xpathData) + 10,
+             xpathOccurrence.shape[1] + 4),
+            ('ConceptOccurrenceAnalysis', len(conceptOccurrence) + 10,
+             conceptOccurrence.shape[1] + 4),
+            ('AVGxpathOccurrence', len(AVGxpathOccurrence) + 1,
+             AVGxpathOccurrence.shape[1]),
+            ('AVGconceptOccurrence', len(AVGconceptOccurrence) + 1,
+             AVGconceptOccurrence.shape[1])):
+        _checkSheetSize(name, rows, cols)
+    countParts = {}
+    if ConceptCounts is not None:
+        countParts['ConceptCounts'] = _sheetParts(
+            'ConceptCounts', ConceptCounts, ['Record', 'Collection'])
+    if xpathCounts is not None:
+        countParts['XpathCounts'] = _sheetParts(
+            'XpathCounts', xpathCounts, ['Record', 'Collection'])
+
+    workbook = xlsxwriter.Workbook(DataDestination,
+                                   {'strings_to_numbers': True})
     workbook.use_zip64()
     cell_format11 = workbook.add_format()
     cell_format11.set_num_format('0%')
@@ -646,525 +2050,480 @@ def OrganizationSpreadsheet(Organization, xpathOccurrence,
     cell_format04.set_num_format('0')
     cell_format05 = workbook.add_format()
     cell_format05.set_num_format('0.00')
-
-    formatGreen = workbook.add_format(
-        {'bg_color': '#C6EFCE', 'font_color': '#006100'})
-    formatRed = workbook.add_format(
-        {'bg_color': '#FFC7CE', 'font_color': '#9C0006'})
-    formatYellow = workbook.add_format(
-        {'bg_color': '#FFEB9C', 'font_color': '#9C6500'})
+    lights = _lightFormats(workbook)
 
     ConceptAnalysisWS = workbook.add_worksheet('ConceptOccurrenceAnalysis')
     conceptOccurrenceWS = workbook.add_worksheet('ConceptOccurrence')
     avgConceptOccurWS = workbook.add_worksheet('AVGconceptOccurrence')
-    if ConceptCounts is not None:
-        conceptcounts = workbook.add_worksheet('ConceptCounts')
-    # ws5 = workbook.add_worksheet('Completeness vs Homogeneity')
+    if 'ConceptCounts' in countParts:
+        _writeParts(workbook, countParts['ConceptCounts'],
+                    cell_format=cell_format04)
     XpathAnalysisWS = workbook.add_worksheet('XpathOccurrenceAnalysis')
     xpathoccurrenceWS = workbook.add_worksheet('XpathOccurrence')
     avgXpathOccurWS = workbook.add_worksheet('AVGxpathOccurrence')
-    if xpathCounts is not None:
-        xpathcounts = workbook.add_worksheet('XpathCounts')
+    if 'XpathCounts' in countParts:
+        _writeParts(workbook, countParts['XpathCounts'],
+                    cell_format=cell_format04)
     XpathAnalysisWS.set_column('A:A', 70)
     XpathAnalysisWS.set_column('B:B', 20)
     ConceptAnalysisWS.set_column('A:A', 70)
     ConceptAnalysisWS.set_column('B:B', 20)
-
     conceptOccurrenceWS.set_column('A:A', 50)
-
-    # create a worksheet from the cncept occurrence csv
-    Reader = csv.reader(
-        open(conceptOccurrence, 'r'), delimiter=',', quotechar='"')
-    row_count = 0
-
-    for row in Reader:
-        for col in range(len(row)):
-            conceptOccurrenceWS.write(row_count, col, row[col], cell_format11)
-        row_count += 1
-
     xpathoccurrenceWS.set_column('A:A', 50)
-
-    def skip_last(iterator):
-        prev = next(iterator)
-        for item in iterator:
-            yield prev
-            prev = item
-    Reader = skip_last(
-        csv.reader(open(xpathOccurrence, 'r'), delimiter=',', quotechar='"'))
-
-    row_count = 0
-
-    for row in Reader:
-        for col in range(len(row)):
-            xpathoccurrenceWS.write(row_count, col, row[col], cell_format11)
-        for col in range(1, len(row)):
-            XpathAnalysisWS.write(
-                row_count + 9, col + 4, row[col], cell_format11
-            )
-
-        for col in range(0, 1):
-            XpathAnalysisWS.write(row_count + 9, col, row[col], cell_format11)
-
-            Xpathcell = xlsxwriter.utility.xl_rowcol_to_cell(row_count + 9, 0)
-            formulaElementSimplifier = (
-                '=MID(' + Xpathcell +
-                ',1+FIND("|",SUBSTITUTE(' + Xpathcell +
-                ',"/","|",LEN(' + Xpathcell + ')-LEN(SUBSTITUTE(' +
-                Xpathcell + ',"/","")))),100)'
-            )
-            XpathAnalysisWS.write(
-                row_count + 9, col + 1, formulaElementSimplifier, cell_format11
-            )
-        row_count += 1
-
     avgXpathOccurWS.set_column('A:A', 50)
     avgConceptOccurWS.set_column('A:A', 30)
-    Reader = csv.reader(
-        open(AVGconceptOccurrence, 'r'), delimiter=',', quotechar='"')
-    row_count = 0
-
-    for row in Reader:
-        for col in range(len(row)):
-            avgConceptOccurWS.write(row_count, col, row[col], cell_format05)
-        row_count += 1
-
-    Reader = csv.reader(
-        open(AVGxpathOccurrence, 'r'), delimiter=',', quotechar='"')
-    row_count = 0
-
-    for row in Reader:
-        for col in range(len(row)):
-            avgXpathOccurWS.write(row_count, col, row[col], cell_format05)
-
-        for col in range(len(row) - 1):
-
-            cell2 = xlsxwriter.utility.xl_rowcol_to_cell(0, col + 1)
-            cell3 = xlsxwriter.utility.xl_rowcol_to_cell(2, col + 5)
-            colRange = xlsxwriter.utility.xl_range(1, col + 1, 500, col + 1)
-            colRange2 = xlsxwriter.utility.xl_range(2, 5, 2, len(row) + 3)
-
-            formula2 = '=COUNTIF(xpathOccurrence!' + colRange + ',">"&0)'
-            XpathAnalysisWS.write(2, col + 5, formula2)
-
-            formula3 = (
-                '=' + cell3 + '/COUNTA(xpathOccurrence!' + colRange + ')')
-            XpathAnalysisWS.write(3, col + 5, formula3, cell_format11)
-
-            formula4 = '=SUM(xpathOccurrence!' + colRange + ')/' + '%s' % cell3
-            XpathAnalysisWS.write(4, col + 5, formula4, cell_format11)
-
-            formula5 = '=' + '%s' % cell3 + '/MAX(' + colRange2 + ')'
-            XpathAnalysisWS.write(5, col + 5, formula5, cell_format11)
-
-            formula6 = (
-                '=COUNTIF(xpathOccurrence!' +
-                colRange + ',">="&1)/' + '%s' % cell3
-            )
-            XpathAnalysisWS.write(6, col + 5, formula6, cell_format11)
-
-            formula7 = (
-                '=COUNTIFS(xpathOccurrence!' +
-                colRange + ',">"&0,xpathOccurrence!' +
-                colRange + ',"<"&1)/' + '%s' % cell3
-            )
-            XpathAnalysisWS.write(7, col + 5, formula7, cell_format11)
-
-            formula1 = (
-                '=VLOOKUP("Number of Records",AVGxpathOccurrence!1:1048576,' +
-                str(col + 2) + ')'
-            )
-            XpathAnalysisWS.write(1, col + 5, formula1)
-
-            cell2 = xlsxwriter.utility.xl_rowcol_to_cell(0, col + 1)
-
-            formula = '=xpathOccurrence!' + '%s' % cell2
-            XpathAnalysisWS.write(0, col + 5, formula)
-            dateFormula = (
-                '=LEFT(RIGHT(xpathOccurrence!' + '%s' % cell2 +
-                ',LEN(xpathOccurrence!' + '%s' % cell2 +
-                ')-FIND("_", xpathOccurrence!' +
-                '%s' % cell2 + ')),FIND("_",xpathOccurrence!' +
-                '%s' % cell2 + '))'
-            )
-            XpathAnalysisWS.write(8, col + 5, dateFormula)
-            collectFormula = (
-                '=LEFT(xpathOccurrence!' + '%s' % cell2 +
-                ',FIND("_",xpathOccurrence!' + '%s' % cell2 + ')-1)'
-            )
-
-            XpathAnalysisWS.write(9, col + 5, collectFormula)
-
-        row_count += 1
-    #######################################################################
-    #
-    if ConceptCounts is not None:
-        Reader = csv.reader(
-            open(ConceptCounts, 'r'), delimiter=',', quotechar='"')
-        row_count = 0
 
-        for row in Reader:
-            for col in range(len(row)):
-                conceptcounts.write(row_count, col, row[col], cell_format04)
-            row_count += 1
-        Reader = csv.reader(
-            open(ConceptCounts, 'r'), delimiter=',', quotechar='"')
-        row_count = 0
-        absRowCount = sum(1 for row in Reader)
-        absColCount = len(next(csv.reader(
-            open(ConceptCounts, 'r'), delimiter=',', quotechar='"'
-        )))
-        conceptcounts.autofilter(0, 0, absRowCount - 1, absColCount - 1)
-    if xpathCounts is not None:
-        Reader = csv.reader(
-            open(xpathCounts, 'r'), delimiter=',', quotechar='"')
-        row_count = 0
-
-        for row in Reader:
-            for col in range(len(row)):
-                xpathcounts.write(row_count, col, row[col], cell_format04)
-            row_count += 1
-        Reader = csv.reader(
-            open(xpathCounts, 'r'), delimiter=',', quotechar='"')
-        row_count = 0
-        absRowCount = sum(1 for row in Reader)
-        absColCount = len(next(csv.reader(
-            open(xpathCounts, 'r'), delimiter=',', quotechar='"'
-        )))
-        xpathcounts.autofilter(0, 0, absRowCount - 1, absColCount - 1)
-
-    XpathAnalysisWS.write('A2', 'Number of Records')
-    XpathAnalysisWS.write('A3', 'Number of Elements / Attributes')
-    XpathAnalysisWS.write(
-        'A4',
-        'Coverage w/r to Repository (CR): \
-     number of elements / total number of elements'
-    )
-    XpathAnalysisWS.write('A5', 'Average Occurrence Rate')
-    XpathAnalysisWS.write('A6', 'Repository Completeness: Number of elements \
-    / number of elements in most complete collection in repository')
-    XpathAnalysisWS.write('A7', 'Homogeneity: Number >= 1 \
-    / Total Number of elements in the collection')
-    XpathAnalysisWS.write('A8', 'Partial Elements: Number < 0 and < 1')
-    XpathAnalysisWS.write('A9', 'Retrieval Date')
-    XpathAnalysisWS.write('B1', 'Formulas')
-    XpathAnalysisWS.write('C1', 'MIN')
-    XpathAnalysisWS.write('D1', 'MAX')
-    XpathAnalysisWS.write('E1', 'AVG')
+    # the last row of the xpath occurrence is left out of its sheets
+    xpathRows = list(_frameRows(xpathOccurrence))[:-1]
+    for row_count, row in enumerate(xpathRows):
+        xpathoccurrenceWS.write_row(row_count, 0, row, cell_format11)
+        XpathAnalysisWS.write_row(row_count + 9, 0, row[:1], cell_format11)
+        XpathAnalysisWS.write_row(row_count + 9, 5, row[1:], cell_format11)
+    if formulas:
+        Xpathcells = [
+            xlsxwriter.utility.xl_rowcol_to_cell(row_count + 9, 0)
+            for row_count in range(len(xpathRows))]
+        XpathAnalysisWS.write_column(9, 1, [
+            '=MID(' + Xpathcell + ',1+FIND("|",SUBSTITUTE(' + Xpathcell +
+            ',"/","|",LEN(' + Xpathcell + ')-LEN(SUBSTITUTE(' + Xpathcell +
+            ',"/","")))),100)' for Xpathcell in Xpathcells], cell_format11)
+
+    for row_count, row in enumerate(_frameRows(conceptOccurrence)):
+        conceptOccurrenceWS.write_row(row_count, 0, row, cell_format11)
+        ConceptAnalysisWS.write_row(row_count + 9, 0, row[:1], cell_format11)
+        ConceptAnalysisWS.write_row(
+            row_count + 9, 5, row[1:], cell_format11)
+    for row_count, row in enumerate(_frameRows(AVGconceptOccurrence)):
+        avgConceptOccurWS.write_row(row_count, 0, row, cell_format05)
+    for row_count, row in enumerate(_frameRows(AVGxpathOccurrence)):
+        avgXpathOccurWS.write_row(row_count, 0, row, cell_format05)
+
+    if formulas:
+        xpathVlookup = (
+            '=VLOOKUP("Number of Records",AVGxpathOccurrence!1:1048576,')
+        lastRow = max(len(xpathData), 1)
+        nAVG = AVGxpathOccurrence.shape[1]
+        _analysisFormulas(XpathAnalysisWS, 'xpathOccurrence', nAVG - 1,
+                          lastRow, nAVG + 3, xpathVlookup, cell_format11)
+        if len(xpathRows):
+            nCols = xpathOccurrence.shape[1]
+            _analysisFormulas(XpathAnalysisWS, 'xpathOccurrence', nCols - 1,
+                              lastRow, nCols + 3, xpathVlookup,
+                              cell_format11)
+        nAVG = AVGconceptOccurrence.shape[1]
+        _analysisFormulas(
+            ConceptAnalysisWS, 'ConceptOccurrence', nAVG - 1,
+            max(len(conceptOccurrence), 1), nAVG + 3,
+            '=VLOOKUP("Number of Records", AVGxpathOccurrence!1:1048576,',
+            cell_format11)
+        _analysisSummary(XpathAnalysisWS, xpathOccurrence.shape[1] + 3,
+                         cell_format04, cell_format11)
+        _analysisSummary(ConceptAnalysisWS, conceptOccurrence.shape[1] + 3,
+                         cell_format04, cell_format11)
+        _collectionTallies(XpathAnalysisWS, 10, len(xpathData) + 10,
+                           xpathOccurrence.shape[1] + 3)
+        _collectionTallies(ConceptAnalysisWS, 10,
+                           len(conceptOccurrence) + 10,
+                           conceptOccurrence.shape[1] + 3)
+    else:
+        XpathAnalysisWS.write_column(10, 1, [
+            str(xpath).rsplit('/', 1)[-1]
+            for xpath in xpathData.iloc[:, 0]], cell_format11)
+        _analysisValues(XpathAnalysisWS, xpathData, AVGxpathOccurrence,
+                        cell_format04, cell_format11)
+        _analysisValues(ConceptAnalysisWS, conceptOccurrence,
+                        AVGxpathOccurrence, cell_format04, cell_format11)
+
+    _analysisLabels(XpathAnalysisWS, XPATH_ANALYSIS_LABELS)
     XpathAnalysisWS.write('B10', 'Element Name')
-    XpathAnalysisWS.write('C10', '#Collections')
-    XpathAnalysisWS.write('D10', '# = 100%')
-    XpathAnalysisWS.write('E10', '# >= 100%')
-
-    for row in range(1, 3):
-        colRange4 = xlsxwriter.utility.xl_range(row, 5, row, 500)
-        miniFormula = '=MIN(' + colRange4 + ')'
-        XpathAnalysisWS.write(row, 2, miniFormula, cell_format04)
-        maxiFormula = '=MAX(' + colRange4 + ')'
-        XpathAnalysisWS.write(row, 3, maxiFormula, cell_format04)
-        avgFormula = '=AVERAGE(' + colRange4 + ')'
-        XpathAnalysisWS.write(row, 4, avgFormula, cell_format04)
-
-    for row in range(3, 8):
-        colRange4 = xlsxwriter.utility.xl_range(row, 5, row, 500)
-        miniFormula = '=MIN(' + colRange4 + ')'
-        XpathAnalysisWS.write(row, 2, miniFormula, cell_format11)
-        maxiFormula = '=MAX(' + colRange4 + ')'
-        XpathAnalysisWS.write(row, 3, maxiFormula, cell_format11)
-        avgFormula = '=AVERAGE(' + colRange4 + ')'
-        XpathAnalysisWS.write(row, 4, avgFormula, cell_format11)
-
-    Reader = csv.reader(
-        open(xpathOccurrence, 'r'), delimiter=',', quotechar='"'
-    )
-    absRowCount = sum(1 for row in Reader)
-    absColCount = len(next(csv.reader(
-        open(xpathOccurrence, 'r'), delimiter=',', quotechar='"'
-    )))
 
+    absRowCount = len(xpathOccurrence) + 1
+    absColCount = xpathOccurrence.shape[1]
     XpathAnalysisWS.autofilter(9, 0, absRowCount + 7, absColCount + 3)
     xpathoccurrenceWS.autofilter(0, 0, absRowCount - 2, absColCount - 1)
     avgXpathOccurWS.autofilter(0, 0, absRowCount - 2, absColCount - 1)
+    _trafficLights(XpathAnalysisWS, 10, 5, absRowCount + 7,
+                   absColCount + 3, *lights)
+    _trafficLights(xpathoccurrenceWS, 1, 1, absRowCount - 2,
+                   absColCount - 1, *lights)
+    _trafficLights(avgXpathOccurWS, 1, 1, absRowCount - 1,
+                   absColCount - 1, *lights)
 
-    XpathAnalysisWS.conditional_format(
-        10, 5, absRowCount + 7, absColCount +
-        3,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen}
-    )
-    XpathAnalysisWS.conditional_format(
-        10, 5, absRowCount + 7, absColCount + 3,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow}
-    )
-    XpathAnalysisWS.conditional_format(
-        10, 5, absRowCount + 7, absColCount + 3,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed}
-    )
-    xpathoccurrenceWS.conditional_format(
-        1, 1, absRowCount - 2, absColCount - 1,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen}
-    )
-    xpathoccurrenceWS.conditional_format(
-        1, 1, absRowCount - 2, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow}
-    )
-    xpathoccurrenceWS.conditional_format(
-        1, 1, absRowCount - 2, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed}
-    )
-    avgXpathOccurWS.conditional_format(
-        1, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen})
-    avgXpathOccurWS.conditional_format(
-        1, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow})
-    avgXpathOccurWS.conditional_format(
-        1, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed})
-    for row in range(10, absRowCount + 8):
-        colRange5 = xlsxwriter.utility.xl_range(row, 5, row, absRowCount + 7)
-        numbCollectFormula = '=COUNTIF(' + colRange5 + ',">"&0)'
-        CompleteCollectFormula = '=COUNTIF(' + colRange5 + ',"="&1)'
-        GreatCollectFormula = '=COUNTIF(' + colRange5 + ',"<"&1)'
-        XpathAnalysisWS.write(row, 2, numbCollectFormula)
-        XpathAnalysisWS.write(row, 3, CompleteCollectFormula)
-        XpathAnalysisWS.write(row, 4, GreatCollectFormula)
-
-    #######################################################################
-    Reader = skip_last(csv.reader(
-        open(xpathOccurrence, 'r'), delimiter=',', quotechar='"'))
-
-    row_count = 0
-    for row in Reader:
-        for col in range(len(row) - 1):
-
-            cell2 = xlsxwriter.utility.xl_rowcol_to_cell(0, col + 1)
-            cell3 = xlsxwriter.utility.xl_rowcol_to_cell(2, col + 5)
-            colRange = xlsxwriter.utility.xl_range(1, col + 1, 500, col + 1)
-            colRange2 = xlsxwriter.utility.xl_range(2, 5, 2, len(row) + 3)
-
-            formula2 = '=COUNTIF(xpathOccurrence!' + colRange + ',">"&0)'
-            XpathAnalysisWS.write(2, col + 5, formula2)
-
-            formula3 = (
-                '=' + cell3 + '/COUNTA(xpathOccurrence!' + colRange + ')')
-            XpathAnalysisWS.write(3, col + 5, formula3, cell_format11)
-
-            formula4 = '=SUM(xpathOccurrence!' + colRange + ')/' + '%s' % cell3
-            XpathAnalysisWS.write(4, col + 5, formula4, cell_format11)
-
-            formula5 = '=' + '%s' % cell3 + '/MAX(' + colRange2 + ')'
-            XpathAnalysisWS.write(5, col + 5, formula5, cell_format11)
-
-            formula6 = (
-                '=COUNTIF(xpathOccurrence!' +
-                colRange + ',">="&1)/' + '%s' % cell3
-            )
-            XpathAnalysisWS.write(6, col + 5, formula6, cell_format11)
-
-            formula7 = (
-                '=COUNTIFS(xpathOccurrence!' +
-                colRange + ',">"&0,xpathOccurrence!' +
-                colRange + ',"<"&1)/' + '%s' % cell3
-            )
-            XpathAnalysisWS.write(7, col + 5, formula7, cell_format11)
-
-            formula1 = (
-                '=VLOOKUP("Number of Records",AVGxpathOccurrence!1:1048576,' +
-                str(col + 2) + ')'
-            )
-            XpathAnalysisWS.write(1, col + 5, formula1)
-
-            cell2 = xlsxwriter.utility.xl_rowcol_to_cell(0, col + 1)
-
-            formula = '=xpathOccurrence!' + '%s' % cell2
-            XpathAnalysisWS.write(0, col + 5, formula)
-            dateFormula = (
-                '=LEFT(RIGHT(xpathOccurrence!' + '%s' % cell2 +
-                ',LEN(xpathOccurrence!' + '%s' % cell2 +
-                ')-FIND("_", xpathOccurrence!' +
-                '%s' % cell2 + ')),FIND("_",xpathOccurrence!' +
-                '%s' % cell2 + '))'
-            )
-            XpathAnalysisWS.write(8, col + 5, dateFormula)
-            collectFormula = (
-                '=LEFT(xpathOccurrence!' + '%s' % cell2 +
-                ',FIND("_",xpathOccurrence!' + '%s' % cell2 + ')-1)'
-            )
-
-            XpathAnalysisWS.write(9, col + 5, collectFormula)
-    #######################################################################
-    Reader = (csv.reader(
-        open(conceptOccurrence, 'r'), delimiter=',', quotechar='"'))
-
-    row_count = 0
-
-    for row in Reader:
-        # for col in range(len(row)):
-        # conceptOccurrenceWS.write(row_count, col, row[col], cell_format11)
-        for col in range(1, len(row)):
-            ConceptAnalysisWS.write(row_count + 9, col + 4,
-                                    row[col], cell_format11)
-
-        for col in range(0, 1):
-            ConceptAnalysisWS.write(row_count + 9,
-                                    col, row[col], cell_format11)
-
-        row_count += 1
+    _analysisLabels(ConceptAnalysisWS, CONCEPT_ANALYSIS_LABELS)
 
-    conceptOccurrenceWS.set_column('A:A', 50)
-    Reader = csv.reader(open(
-        AVGconceptOccurrence, 'r'), delimiter=',', quotechar='"')
-    row_count = 0
-
-    for row in Reader:
-        for col in range(len(row) - 1):
-            cell2 = xlsxwriter.utility.xl_rowcol_to_cell(0, col + 1)
-            cell3 = xlsxwriter.utility.xl_rowcol_to_cell(2, col + 5)
-            colRange = xlsxwriter.utility.xl_range(1, col + 1, 500, col + 1)
-            colRange2 = xlsxwriter.utility.xl_range(2, 5, 2, len(row) + 3)
-            formula2 = '=COUNTIF(ConceptOccurrence!' + colRange + ',">"&0)'
-            ConceptAnalysisWS.write(2, col + 5, formula2)
-
-            formula3 = (
-                '=' + cell3 + '/COUNTA(ConceptOccurrence!' + colRange + ')'
-            )
-            ConceptAnalysisWS.write(3, col + 5, formula3, cell_format11)
-
-            formula4 = (
-                '=SUM(ConceptOccurrence!' + colRange + ')/' + '%s' % cell3)
-            ConceptAnalysisWS.write(4, col + 5, formula4, cell_format11)
-
-            formula5 = '=' + '%s' % cell3 + '/MAX(' + colRange2 + ')'
-            ConceptAnalysisWS.write(5, col + 5, formula5, cell_format11)
-
-            formula6 = (
-                '=COUNTIF(ConceptOccurrence!' +
-                colRange + ',">="&1)/' + '%s' % cell3)
-
-            ConceptAnalysisWS.write(6, col + 5, formula6, cell_format11)
-
-            formula7 = (
-                '=COUNTIFS(ConceptOccurrence!' + colRange +
-                ',">"&0,ConceptOccurrence!' + colRange + ',"<"&1)/' +
-                '%s' % cell3)
-
-            ConceptAnalysisWS.write(7, col + 5, formula7, cell_format11)
-
-            formula1 = (
-                '=VLOOKUP("Number of Records", AVGxpathOccurrence!1:1048576,' +
-                str(col + 2) + ')'
-            )
-
-            ConceptAnalysisWS.write(1, col + 5, formula1)
-
-            cell2 = xlsxwriter.utility.xl_rowcol_to_cell(0, col + 1)
-
-            formula = '=ConceptOccurrence!' + '%s' % cell2
-            ConceptAnalysisWS.write(0, col + 5, formula)
-            dateFormula = (
-                '=LEFT(RIGHT(ConceptOccurrence!' + '%s' % cell2 +
-                ',LEN(ConceptOccurrence!' + '%s' % cell2 +
-                ')-FIND("_", ConceptOccurrence!' + '%s' % cell2 +
-                ')),FIND("_",ConceptOccurrence!' + '%s' % cell2 + '))')
-
-            ConceptAnalysisWS.write(8, col + 5, dateFormula)
-            collectFormula = (
-                '=LEFT(ConceptOccurrence!' + '%s' % cell2 +
-                ',FIND("_",ConceptOccurrence!' + '%s' % cell2 + ')-1)')
-
-            ConceptAnalysisWS.write(9, col + 5, collectFormula)
-
-        row_count += 1
-    #######################################################################
-    #
-    ConceptAnalysisWS.write('A2', 'Number of Records')
-    ConceptAnalysisWS.write('A3', 'Number of Concepts')
-    ConceptAnalysisWS.write('A4', 'Coverage w/r to Repository (CR): \
-    number of concepts / total number of concepts')
-    ConceptAnalysisWS.write('A5', 'Average Occurrence Rate')
-    ConceptAnalysisWS.write(
-        'A6',
-        'Repository Completeness:\
-    Number of concepts / number of concepts\
-    in most complete collection in repository'
-    )
-    ConceptAnalysisWS.write('A7', 'Homogeneity: Number >= 1 /\
-     Total Number of concepts in the collection')
-    ConceptAnalysisWS.write('A8', 'Partial Concepts: Number < 0 and < 1')
-    ConceptAnalysisWS.write('A9', 'Retrieval Date')
-    ConceptAnalysisWS.write('B1', 'Formulas')
-    ConceptAnalysisWS.write('C1', 'MIN')
-    ConceptAnalysisWS.write('D1', 'MAX')
-    ConceptAnalysisWS.write('E1', 'AVG')
-    ConceptAnalysisWS.write('C10', '#Collections')
-    ConceptAnalysisWS.write('D10', '# = 100%')
-    ConceptAnalysisWS.write('E10', '# >= 100%')
-
-    for row in range(1, 3):
-        colRange4 = xlsxwriter.utility.xl_range(row, 5, row, 500)
-        miniFormula = '=MIN(' + colRange4 + ')'
-        ConceptAnalysisWS.write(row, 2, miniFormula, cell_format04)
-        maxiFormula = '=MAX(' + colRange4 + ')'
-        ConceptAnalysisWS.write(row, 3, maxiFormula, cell_format04)
-        avgFormula = '=AVERAGE(' + colRange4 + ')'
-        ConceptAnalysisWS.write(row, 4, avgFormula, cell_format04)
-
-    for row in range(3, 8):
-        colRange4 = xlsxwriter.utility.xl_range(row, 5, row, 500)
-        miniFormula = '=MIN(' + colRange4 + ')'
-        ConceptAnalysisWS.write(row, 2, miniFormula, cell_format11)
-        maxiFormula = '=MAX(' + colRange4 + ')'
-        ConceptAnalysisWS.write(row, 3, maxiFormula, cell_format11)
-        avgFormula = '=AVERAGE(' + colRange4 + ')'
-        ConceptAnalysisWS.write(row, 4, avgFormula, cell_format11)
-
-    Reader = csv.reader(
-        open(conceptOccurrence, 'r'), delimiter=',', quotechar='"')
-    absRowCount = sum(1 for row in Reader)
-    absColCount = len(next(csv.reader(
-        open(conceptOccurrence, 'r'), delimiter=',', quotechar='"')))
+    absRowCount = len(conceptOccurrence) + 1
+    absColCount = conceptOccurrence.shape[1]
     ConceptAnalysisWS.autofilter(9, 0, absRowCount + 8, absColCount + 3)
     conceptOccurrenceWS.autofilter(0, 0, absRowCount - 1, absColCount - 1)
     avgConceptOccurWS.autofilter(0, 0, absRowCount - 1, absColCount - 1)
-    ConceptAnalysisWS.conditional_format(
-        10, 5, absRowCount + 8, absColCount + 3,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen})
-    ConceptAnalysisWS.conditional_format(
-        10, 5, absRowCount + 8, absColCount + 3,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow})
-    ConceptAnalysisWS.conditional_format(
-        10, 5, absRowCount + 8, absColCount + 3,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed})
-    conceptOccurrenceWS.conditional_format(
-        1, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen})
-    conceptOccurrenceWS.conditional_format(
-        1, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow})
-    conceptOccurrenceWS.conditional_format(
-        1, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed})
-    avgConceptOccurWS.conditional_format(
-        1, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen})
-    avgConceptOccurWS.conditional_format(
-        1, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow})
-    avgConceptOccurWS.conditional_format(
-        1, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed})
-
-    for row in range(10, absRowCount + 9):
-        colRange5 = xlsxwriter.utility.xl_range(row, 5, row, absColCount + 7)
-        numbCollectFormula = '=COUNTIF(' + colRange5 + ',">"&0)'
-        CompleteCollectFormula = '=COUNTIF(' + colRange5 + ',"="&1)'
-        GreatCollectFormula = '=COUNTIF(' + colRange5 + ',"<"&1)'
-        ConceptAnalysisWS.write(row, 2, numbCollectFormula)
-        ConceptAnalysisWS.write(row, 3, CompleteCollectFormula)
-        ConceptAnalysisWS.write(row, 4, GreatCollectFormula)
+    _trafficLights(ConceptAnalysisWS, 10, 5, absRowCount + 8,
+                   absColCount + 3, *lights)
+    _trafficLights(conceptOccurrenceWS, 1, 1, absRowCount - 1,
+                   absColCount - 1, *lights)
+    _trafficLights(avgConceptOccurWS, 1, 1, absRowCount - 1,
+                   absColCount - 1, *lights)
+
+    workbook.close()
+
+
+def OrganizationSpreadsheet(Organization, xpathOccurrence,
+                            AVGxpathOccurrence, conceptOccurrence,
+                            AVGconceptOccurrence,
+                            ConceptCounts=None, xpathCounts=None,
+                            DataDestination=None, formulas=False):
+    # create spreadsheet for an organization
+    """requires each xpath and concept occurrence,
+    csv for a organization
+    (or any group of collections you want to compare)
+    Each input may be a path or a dataframe; every file is read once and
+    the workbook is written by ``organizationWorkbook``. Pass ``formulas``
+    for live spreadsheet formulas in the analysis sheets.
+    """
+    if DataDestination is None:
+        if ConceptCounts is not None and xpathCounts is not None:
+            reports = '../../reports/'
+        else:
+            reports = '../reports/'
+        os.makedirs(reports + Organization, exist_ok=True)
+        DataDestination = (reports + Organization + '/' + Organization +
+                           '_Report.xlsx')
+    if ConceptCounts is not None:
+        ConceptCounts = _sheetFrame(ConceptCounts)
+    if xpathCounts is not None:
+        xpathCounts = _sheetFrame(xpathCounts)
+    organizationWorkbook(
+        Organization, _sheetFrame(xpathOccurrence),
+        _sheetFrame(AVGxpathOccurrence), _sheetFrame(conceptOccurrence),
+        _sheetFrame(AVGconceptOccurrence), DataDestination,
+        ConceptCounts, xpathCounts, formulas)
 
+
+# report backends: the sheets of the spreadsheets as a SQLite database,
+# Parquet files or static HTML pages, for tools that do not need Excel
+
+def _reportFrame(Table):
+    """Return ``Table`` if it is a dataframe, otherwise read it with
+    ``readTable`` so that numbers keep their types.
+    """
+    if isinstance(Table, pd.DataFrame):
+        return Table
+    return readTable(Table)
+
+
+def collectionSheets(EvaluatedConcepts, EvaluatedXpaths,
+                     xpathOccurrence, xpathCounts,
+                     conceptOccurrence, conceptCounts):
+    """Return the sheets of the collection spreadsheet as a dict of sheet
+    name to dataframe, in workbook order, and a dict of the cells of each
+    sheet that get traffic lights, as (first row, first column, last
+    column or None for the last) with the header as row 0. Each input may
+    be a path or a dataframe.
+    """
+    sheets = {
+        'ConceptOccurrence': _reportFrame(conceptOccurrence),
+        'ConceptCounts': _reportFrame(conceptCounts),
+        'ConceptContent': _reportFrame(EvaluatedConcepts),
+        'XpathOccurrence': _reportFrame(xpathOccurrence),
+        'XpathCounts': _reportFrame(xpathCounts),
+        'XpathContent': _reportFrame(EvaluatedXpaths)}
+    lights = {'ConceptOccurrence': (2, 5, 5), 'ConceptCounts': (1, 2, None),
+              'XpathOccurrence': (2, 5, 5), 'XpathCounts': (1, 2, None)}
+    return sheets, lights
+
+
+def _analysisFrames(Occurrence, AVGxpathOccurrence, Items):
+    """Return the two blocks of an analysis sheet as dataframes: the
+    metrics of each collection (see ``_occurrenceMetrics``), a row per
+    collection column of ``Occurrence`` with a float column per metric
+    (``Items`` is Elements or Concepts) and its Retrieval Date and
+    Collection, and ``Occurrence`` with the number of collections above
+    0, equal to 1 and below 1 of each row. The MIN, MAX and AVG of the
+    spreadsheet are left to the queries of the report.
+    """
+    rows, summary, tallies = _occurrenceMetrics(
+        Occurrence, AVGxpathOccurrence)
+    metrics = ['Number of Records', 'Number of ' + Items, 'Coverage',
+               'Average Occurrence Rate', 'Repository Completeness',
+               'Homogeneity', 'Partial ' + Items]
+    summaryDF = pd.DataFrame({'Name': rows[0]})
+    for metric, values in zip(metrics, rows[1:8]):
+        summaryDF[metric] = np.asarray(values, dtype=float)
+    summaryDF['Retrieval Date'] = rows[8]
+    summaryDF['Collection'] = rows[9]
+    talliesDF = pd.concat([
+        Occurrence.iloc[:, :1].reset_index(drop=True),
+        pd.DataFrame(np.asarray(tallies, dtype=int).reshape(-1, 3),
+                     columns=['#Collections', '# = 100%', '# >= 100%']),
+        Occurrence.iloc[:, 1:].reset_index(drop=True)], axis=1)
+    return summaryDF, talliesDF
+
+
+def organizationSheets(xpathOccurrence, AVGxpathOccurrence,
+                       conceptOccurrence, AVGconceptOccurrence,
+                       ConceptCounts=None, xpathCounts=None):
+    """Return the sheets of the organization spreadsheet and their
+    traffic light cells like ``collectionSheets``. Each analysis sheet
+    becomes two tables, ConceptOccurrenceAnalysis with a row of metrics
+    for each collection and ConceptOccurrenceTallies with the occurrence of
+    every concept (likewise for xpaths), holding the values
+    ``organizationWorkbook`` writes by default.
+    """
+    xpathOccurrence = _reportFrame(xpathOccurrence)
+    AVGxpathOccurrence = _reportFrame(AVGxpathOccurrence)
+    conceptOccurrence = _reportFrame(conceptOccurrence)
+    AVGconceptOccurrence = _reportFrame(AVGconceptOccurrence)
+    # the last row of the xpath occurrence is left out of its sheets
+    xpathData = xpathOccurrence.iloc[:max(len(xpathOccurrence) - 1, 0)]
+    conceptAnalysis, conceptTallies = _analysisFrames(
+        conceptOccurrence, AVGxpathOccurrence, 'Concepts')
+    xpathAnalysis, xpathTallies = _analysisFrames(
+        xpathData, AVGxpathOccurrence, 'Elements')
+    xpathTallies.insert(1, 'Element Name', [
+        str(xpath).rsplit('/', 1)[-1] for xpath in xpathData.iloc[:, 0]])
+
+    sheets = {'ConceptOccurrenceAnalysis': conceptAnalysis,
+              'ConceptOccurrenceTallies': conceptTallies,
+              'ConceptOccurrence': conceptOccurrence,
+              'AVGconceptOccurrence': AVGconceptOccurrence}
+    if ConceptCounts is not None:
+        sheets['ConceptCounts'] = _reportFrame(ConceptCounts)
+    sheets.update({'XpathOccurrenceAnalysis': xpathAnalysis,
+                   'XpathOccurrenceTallies': xpathTallies,
+                   'XpathOccurrence': xpathData,
+                   'AVGxpathOccurrence': AVGxpathOccurrence})
+    if xpathCounts is not None:
+        sheets['XpathCounts'] = _reportFrame(xpathCounts)
+    lights = {'ConceptOccurrenceTallies': (1, 4, None),
+              'ConceptOccurrence': (1, 1, None),
+              'AVGconceptOccurrence': (1, 1, None),
+              'XpathOccurrenceTallies': (1, 5, None),
+              'XpathOccurrence': (1, 1, None),
+              'AVGxpathOccurrence': (1, 1, None)}
+    return sheets, lights
+
+
+def _lightClasses(DF, lights):
+    """Return an array the shape of ``DF`` with the traffic light class
+    of every cell: 'green' for at least 1, 'yellow' for 0 and 'red' for
+    -1 within ``lights`` (first row, first column, last column or None),
+    '' otherwise.
+    """
+    classes = np.full(DF.shape, '', dtype=object)
+    if lights is None:
+        return classes
+    first_row, first_col, last_col = lights
+    if last_col is None:
+        last_col = DF.shape[1] - 1
+    block = DF.iloc[first_row - 1:, first_col:last_col + 1]
+    if block.size == 0:
+        return classes
+    values = np.column_stack([
+        pd.to_numeric(pd.Series(block.iloc[:, col].to_numpy(dtype=object)),
+                      errors='coerce').to_numpy(dtype=float)
+        for col in range(block.shape[1])])
+    classes[first_row - 1:, first_col:last_col + 1] = np.select(
+        [values >= 1, values == 0, values == -1],
+        list(LIGHT_COLOURS), '')
+    return classes
+
+
+def _xlsxReport(Sheets, DataDestination, Lights):
+    """Write each sheet as a worksheet, split or transposed when it does
+    not fit (see ``_sheetParts``), with its traffic lights.
+    """
+    sheets = [(name, _sheetParts(name, DF, [
+        column for column in ('Record', 'Collection')
+        if column in DF.columns])) for name, DF in Sheets.items()]
+    workbook = xlsxwriter.Workbook(
+        DataDestination,
+        {'constant_memory': True, 'strings_to_urls': False})
+    lightFormats = _lightFormats(workbook)
+    for name, parts in sheets:
+        _writeParts(workbook, parts, lights=Lights.get(name),
+                    lightFormats=lightFormats)
     workbook.close()
 
 
+# SQLite's default limit on the columns of a table
+SQLITE_MAX_COLUMNS = 2000
+
+
+def _sqliteReport(Sheets, DataDestination, Lights):
+    """Write each sheet as a table of a SQLite database, replacing any
+    table of the same name. A counts matrix with more columns than a
+    table allows is stored long instead: its Record and Collection, the
+    Key (xpath or concept) and the Count, for the counts above 0.
+    """
+    connection = sqlite3.connect(DataDestination)
+    try:
+        for name, DF in Sheets.items():
+            DF = DF.copy(deep=False)
+            for column in DF.columns:
+                if isinstance(DF[column].dtype, pd.SparseDtype):
+                    DF[column] = DF[column].sparse.to_dense()
+            DF.columns = [str(column) for column in DF.columns]
+            if DF.shape[1] > SQLITE_MAX_COLUMNS:
+                idColumns = [column for column in ('Record', 'Collection')
+                             if column in DF.columns]
+                if not idColumns:
+                    raise ValueError(
+                        '{} has {} columns, more than the {} of a SQLite '
+                        'table'.format(name, DF.shape[1],
+                                       SQLITE_MAX_COLUMNS))
+                DF = DF.melt(id_vars=idColumns, var_name='Key',
+                             value_name='Count')
+                DF = DF[DF['Count'] > 0]
+            DF.to_sql(name, connection, if_exists='replace', index=False)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _parquetReport(Sheets, DataDestination, Lights):
+    """Write each sheet to name.parquet in the ``DataDestination``
+    directory with ``writeTable``.
+    """
+    os.makedirs(DataDestination, exist_ok=True)
+    for name, DF in Sheets.items():
+        writeTable(DF, os.path.join(DataDestination, name + '.parquet'))
+
+
+HTML_PAGE_ROWS = 1000
+HTML_STYLE = (
+    'body{font-family:sans-serif}'
+    'table{border-collapse:collapse}'
+    'th,td{border:1px solid #ccc;padding:2px 6px;text-align:left}' +
+    ''.join('.{}{{background:{};color:{}}}'.format(light, *colours)
+            for light, colours in LIGHT_COLOURS.items()))
+
+
+def _htmlPage(title, body):
+    return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8">'
+            '<title>{0}</title><style>{1}</style></head>\n<body>'
+            '<h1>{0}</h1>\n{2}\n</body></html>\n'.format(
+                html.escape(title), HTML_STYLE, body))
+
+
+def _htmlLink(href, text):
+    return '<a href="{}">{}</a>'.format(
+        urllib.parse.quote(href), html.escape(text))
+
+
+def _htmlReport(Sheets, DataDestination, Lights, page_rows=HTML_PAGE_ROWS):
+    """Write each sheet as static HTML pages of ``page_rows`` rows,
+    name_1.html, name_2.html and so on, in the ``DataDestination``
+    directory, with an index.html of the sheets. The traffic lights are
+    worked out here and given to the cells as the green, yellow and red
+    classes, so the pages need no scripts.
+    """
+    os.makedirs(DataDestination, exist_ok=True)
+    index = []
+    for name, DF in Sheets.items():
+        classes = _lightClasses(DF, Lights.get(name))
+        pages = max(-(-len(DF) // page_rows), 1)
+        header = '<tr>' + ''.join(
+            '<th>{}</th>'.format(html.escape(str(column)))
+            for column in DF.columns) + '</tr>'
+        for page in range(pages):
+            start = page * page_rows
+            links = [_htmlLink('index.html', 'Index')]
+            if page:
+                links.append(_htmlLink(
+                    '{}_{}.html'.format(name, page), 'Previous'))
+            if page + 1 < pages:
+                links.append(_htmlLink(
+                    '{}_{}.html'.format(name, page + 2), 'Next'))
+            rows = [header]
+            for row, rowClasses in zip(
+                    _frameRows(DF.iloc[start:start + page_rows],
+                               header=False),
+                    classes[start:start + page_rows].tolist()):
+                rows.append('<tr>' + ''.join(
+                    ('<td class="{}">'.format(light) if light else '<td>') +
+                    html.escape('' if value is None else str(value)) +
+                    '</td>' for value, light in zip(row, rowClasses)) +
+                    '</tr>')
+            body = ('<p>Page {} of {}, rows {} to {} of {}. {}</p>\n'
+                    '<table>\n{}\n</table>'.format(
+                        page + 1, pages, min(start + 1, len(DF)),
+                        min(start + page_rows, len(DF)), len(DF),
+                        ' '.join(links), '\n'.join(rows)))
+            with open(os.path.join(DataDestination, '{}_{}.html'.format(
+                    name, page + 1)), 'w', encoding='utf-8') as f:
+                f.write(_htmlPage(name, body))
+        index.append('<li>{} ({} rows, {} pages)</li>'.format(
+            _htmlLink(name + '_1.html', name), len(DF), pages))
+    with open(os.path.join(DataDestination, 'index.html'), 'w',
+              encoding='utf-8') as f:
+        f.write(_htmlPage(os.path.basename(os.path.normpath(
+            DataDestination)), '<ul>\n' + '\n'.join(index) + '\n</ul>'))
+
+
+REPORT_BACKENDS = {'xlsx': _xlsxReport, 'sqlite': _sqliteReport,
+                   'parquet': _parquetReport, 'html': _htmlReport}
+# what runCollection calls the report of each backend, after the
+# Collection_Dialect_ prefix
+REPORT_NAMES = {'xlsx': 'Spreadsheet.xlsx', 'sqlite': 'Report.sqlite',
+                'parquet': 'Report_parquet', 'html': 'Report_html'}
+
+
+def writeReport(Sheets, DataDestination, Backend='xlsx', Lights=None):
+    """Write ``Sheets``, a dict of sheet name to dataframe such as
+    ``collectionSheets`` and ``organizationSheets`` return, with one of
+    the ``REPORT_BACKENDS``: 'xlsx' for a plain workbook, 'sqlite' for a
+    database file with a table per sheet, 'parquet' for a directory with
+    a file per sheet or 'html' for a directory of paginated static pages.
+    ``Lights`` gives the traffic light cells of each sheet, coloured in
+    the workbook and classified in advance in the HTML pages.
+    """
+    if Backend not in REPORT_BACKENDS:
+        raise ValueError('unknown report backend {!r}, expected one of '
+                         '{}'.format(Backend, ', '.join(REPORT_BACKENDS)))
+    REPORT_BACKENDS[Backend](Sheets, DataDestination, Lights or {})
+
+
+def collectionReport(Organization, Collection, Dialect,
+                     EvaluatedConcepts, EvaluatedXpaths,
+                     xpathOccurrence, xpathCounts,
+                     conceptOccurrence, conceptCounts,
+                     DataDestination, Backend='xlsx'):
+    """Write the collection report with ``Backend``: the collection
+    spreadsheet of ``collectionSpreadsheet`` for 'xlsx', otherwise the
+    same sheets through ``writeReport``.
+    """
+    if Backend == 'xlsx':
+        collectionSpreadsheet(
+            Organization, Collection, Dialect, EvaluatedConcepts,
+            EvaluatedXpaths, xpathOccurrence, xpathCounts,
+            conceptOccurrence, conceptCounts, DataDestination)
+        return
+    sheets, lights = collectionSheets(
+        EvaluatedConcepts, EvaluatedXpaths, xpathOccurrence, xpathCounts,
+        conceptOccurrence, conceptCounts)
+    writeReport(sheets, DataDestination, Backend, lights)
+
+
+def organizationReport(Organization, xpathOccurrence,
+                       AVGxpathOccurrence, conceptOccurrence,
+                       AVGconceptOccurrence, DataDestination,
+                       ConceptCounts=None, xpathCounts=None,
+                       Backend='xlsx'):
+    """Write the organization report with ``Backend``: the organization
+    spreadsheet of ``OrganizationSpreadsheet`` for 'xlsx', otherwise the
+    same sheets through ``writeReport``.
+    """
+    if Backend == 'xlsx':
+        OrganizationSpreadsheet(
+            Organization, xpathOccurrence, AVGxpathOccurrence,
+            conceptOccurrence, AVGconceptOccurrence, ConceptCounts,
+            xpathCounts, DataDestination)
+        return
+    sheets, lights = organizationSheets(
+        xpathOccurrence, AVGxpathOccurrence, conceptOccurrence,
+        AVGconceptOccurrence, ConceptCounts, xpathCounts)
+    writeReport(sheets, DataDestination, Backend, lights)
+
+
 def WriteGoogleSheets(SpreadsheetLocation):
     """requires collectionSpreadsheet or
     OrganizationSpreadsheet output.
@@ -1209,42 +2568,19 @@ def WriteGoogleSheets(SpreadsheetLocation):
     display(HTML(ReportURLstring))
 
 
-def recordConceptContent(EvaluatedMetadataDF):
+def recordConceptContent(EvaluatedMetadataDF, DialectLocation=None):
     """requires a dataframe with concepts. Creates a vertical view of
     concept content for each record in the collection. Useful in the
-    creation of json.
+    creation of json. Concepts are filled in from the
+    ``DialectLocation`` dialect registry.
     """
-    EvaluatedMetadataDF = EvaluatedMetadataDF.applymap(str)
-    Dialect = EvaluatedMetadataDF.at[1, 'Dialect']
-    group_name = EvaluatedMetadataDF.groupby([
-        'Collection', 'Record', 'Concept'], as_index=False)
-    occurrenceMatrix = group_name['Content'].apply(
-        lambda x: '%s' % ', '.join(x)).unstack().reset_index()
-    dialectOccurrenceDF = pd.read_csv('./dialectContains.csv')
-    dialectOccurrenceDF = (dialectOccurrenceDF[
-        dialectOccurrenceDF['Concept'] == Dialect])
-    occurrenceMatrix.columns.names = ['']
-    occurrenceMatrix = pd.concat(
-        [dialectOccurrenceDF, occurrenceMatrix],
-        axis=0, ignore_index=True #, sort=True
-    )
-    mid = occurrenceMatrix['Collection']
-    mid2 = occurrenceMatrix['Record']
-    occurrenceMatrix.drop(
-        labels=['Collection', 'Record', 'Concept'], axis=1, inplace=True)
-    occurrenceMatrix.insert(0, 'Collection', mid)
-    occurrenceMatrix.insert(0, 'Record', mid2)
-
-    dialectOccurrenceDF = pd.read_csv('./dialectContains.csv')
-    dialectOccurrenceDF = (
-        dialectOccurrenceDF[dialectOccurrenceDF['Concept'] == Dialect])
-    FILLvalues = dialectOccurrenceDF.to_dict('records')
-    FILLvalues = FILLvalues[0]
-    occurrenceMatrix = occurrenceMatrix.fillna(value=FILLvalues)
-    occurrenceMatrix.reset_index()
-    occurrenceMatrix = occurrenceMatrix.drop(occurrenceMatrix.index[0])
-
-    return(occurrenceMatrix)
+    EvaluatedMetadataDF = EvaluatedMetadataDF.astype(str)
+    Dialect = EvaluatedMetadataDF['Dialect'].iat[0]
+    occurrenceMatrix = EvaluatedMetadataDF.groupby(
+        ['Collection', 'Record', 'Concept'], observed=True
+    )['Content'].agg(', '.join).unstack().reset_index()
+    return(_dialectConceptCounts(occurrenceMatrix, Dialect,
+                                 DialectLocation=DialectLocation))
 
 
 def recordXpathContent(EvaluatedMetadataDF):
@@ -1255,7 +2591,7 @@ def recordXpathContent(EvaluatedMetadataDF):
     EvaluatedMetadataDF = EvaluatedMetadataDF.applymap(str)
 
     group_name = EvaluatedMetadataDF.groupby([
-        'Collection', 'Record', 'XPath'], as_index=False)
+        'Collection', 'Record', 'XPath'], as_index=False, observed=True)
     occurrenceMatrix = group_name['Content'].apply(
         lambda x: '%s' % ', '.join(x)).unstack().reset_index()
 
@@ -1267,3 +2603,208 @@ def recordXpathContent(EvaluatedMetadataDF):
     #occurrenceMatrix = occurrenceMatrix.drop(occurrenceMatrix.index[0])
 
     return(occurrenceMatrix)
+
+
+# Run the whole pipeline for many collections
+
+BATCH_COLUMNS = ['Organization', 'Collection', 'Dialect', 'Status',
+                 'StepsRun', 'StepsSkipped', 'Elapsed', 'Error']
+PIPELINE_STEPS = ['evaluate', 'concepts', 'xpaths', 'spreadsheet']
+
+
+def readBatchManifest(manifest):
+    """Read a batch manifest csv with Organization, Collection, Dialect
+    and MetadataLocation columns into a list of dicts.
+    """
+    manifestDF = pd.read_csv(manifest, dtype=str, keep_default_na=False)
+    return manifestDF.to_dict('records')
+
+
+def _collectionProducts(OutputLocation, Organization, Collection, Dialect,
+                        Backend='xlsx'):
+    prefix = os.path.join(OutputLocation, Organization,
+                          Collection + '_' + Dialect + '_')
+    return {
+        'ElementEvaluated': prefix + 'ElementEvaluated.csv',
+        'ConceptEvaluated': prefix + 'ConceptEvaluated.csv',
+        'conceptCounts': prefix + 'conceptCounts.csv',
+        'conceptOccurrence': prefix + 'conceptOccurrence.csv',
+        'XpathCounts': prefix + 'XpathCounts.csv',
+        'xpathOccurrence': prefix + 'xpathOccurrence.csv',
+        'Spreadsheet': prefix + REPORT_NAMES[Backend],
+        'Checkpoint': prefix + 'checkpoint.json'}
+
+
+def _writeCheckpoint(checkpoint, CheckpointLocation):
+    tmp = CheckpointLocation + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f, indent=1)
+    os.replace(tmp, CheckpointLocation)
+
+
+def runCollection(Organization, Collection, Dialect, MetadataLocation,
+                  OutputLocation='./data/', Evaluator='service',
+                  CrosswalkLocation='./AllCrosswalks.xml', resume=True,
+                  Backend='xlsx', DialectLocation=None):
+    """Run the pipeline for one collection: evaluate the records (with
+    the web service, or locally when ``Evaluator`` is 'local'), write the
+    concept and xpath counts and occurrence tables, and build the
+    collection spreadsheet, or the report of another of the
+    ``REPORT_BACKENDS``. Concept counts are filled in from the
+    ``DialectLocation`` dialect registry (see ``dialectRegistry``).
+    Everything goes to ``OutputLocation``/``Organization`` under names
+    starting with Collection_Dialect_.
+    Finished steps are recorded in a checkpoint json next to the outputs;
+    with ``resume`` a step whose outputs still exist is not run again,
+    unless a step before it had to be.
+    Returns a dict with the ``BATCH_COLUMNS`` of the run.
+    """
+    start = time.perf_counter()
+    products = _collectionProducts(
+        OutputLocation, Organization, Collection, Dialect, Backend)
+    os.makedirs(os.path.join(OutputLocation, Organization), exist_ok=True)
+    checkpoint = {'Organization': Organization, 'Collection': Collection,
+                  'Dialect': Dialect, 'Steps': {}}
+    if resume and os.path.exists(products['Checkpoint']):
+        with open(products['Checkpoint']) as f:
+            checkpoint = json.load(f)
+    tables = {}
+
+    def evaluated(name):
+        if name not in tables:
+            tables[name] = readTable(products[name])
+        return tables[name]
+
+    def evaluate():
+        if Evaluator == 'local':
+            tables['ElementEvaluated'], tables['ConceptEvaluated'] = (
+                localXMLeval(MetadataLocation, Organization, Collection,
+                             Dialect, CrosswalkLocation, OutputLocation))
+        else:
+            # the service results are read from their files when needed
+            XMLeval(MetadataLocation, Organization, Collection, Dialect,
+                    OutputLocation)
+        return ['ElementEvaluated', 'ConceptEvaluated']
+
+    def concepts():
+        tables['conceptCounts'], tables['conceptOccurrence'] = (
+            occurrenceProducts(
+                evaluated('ConceptEvaluated'), Organization, Collection,
+                Dialect, 'Concept', products['conceptCounts'],
+                products['conceptOccurrence'],
+                DialectLocation=DialectLocation))
+        return ['conceptCounts', 'conceptOccurrence']
+
+    def xpaths():
+        tables['XpathCounts'], tables['xpathOccurrence'] = (
+            occurrenceProducts(
+                evaluated('ElementEvaluated'), Organization, Collection,
+                Dialect, 'XPath', products['XpathCounts'],
+                products['xpathOccurrence']))
+        return ['XpathCounts', 'xpathOccurrence']
+
+    def spreadsheet():
+        # products made in this run are passed on in memory, others read
+        sheets = [tables.get(name, products[name]) for name in (
+            'ConceptEvaluated', 'ElementEvaluated', 'xpathOccurrence',
+            'XpathCounts', 'conceptOccurrence', 'conceptCounts')]
+        collectionReport(Organization, Collection, Dialect, *sheets,
+                         products['Spreadsheet'], Backend)
+        return ['Spreadsheet']
+
+    steps = {'evaluate': evaluate, 'concepts': concepts,
+             'xpaths': xpaths, 'spreadsheet': spreadsheet}
+    run, skipped = [], []
+    for position, step in enumerate(PIPELINE_STEPS):
+        done = checkpoint['Steps'].get(step)
+        if done is not None and all(
+                os.path.exists(products[name]) for name in done['Outputs']):
+            skipped.append(step)
+            continue
+        # the later steps depend on this one, so they are run again too
+        for later in PIPELINE_STEPS[position:]:
+            checkpoint['Steps'].pop(later, None)
+        stepStart = time.perf_counter()
+        outputs = steps[step]()
+        checkpoint['Steps'][step] = {
+            'Outputs': outputs,
+            'Elapsed': time.perf_counter() - stepStart}
+        _writeCheckpoint(checkpoint, products['Checkpoint'])
+        run.append(step)
+    return {'Organization': Organization, 'Collection': Collection,
+            'Dialect': Dialect, 'Status': 'done',
+            'StepsRun': ' '.join(run), 'StepsSkipped': ' '.join(skipped),
+            'Elapsed': time.perf_counter() - start, 'Error': ''}
+
+
+def runBatch(manifest, OutputLocation='./data/', workers=1,
+             resume=True, Evaluator='service',
+             CrosswalkLocation='./AllCrosswalks.xml', Backend='xlsx',
+             DialectLocation=None):
+    """Run ``runCollection`` for every row of a batch ``manifest`` (a csv
+    path or a list of dicts, see ``readBatchManifest``), ``workers``
+    collections at a time in a process pool. A collection that fails is
+    reported and the others carry on; running the batch again with
+    ``resume`` picks each collection up from its last finished step.
+    Returns a DataFrame with ``BATCH_COLUMNS``, one row per collection in
+    manifest order.
+    """
+    if isinstance(manifest, str):
+        manifest = readBatchManifest(manifest)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(
+            runCollection, row['Organization'], row['Collection'],
+            row['Dialect'], row['MetadataLocation'], OutputLocation,
+            Evaluator, CrosswalkLocation, resume, Backend,
+            DialectLocation)
+            for row in manifest]
+        results = []
+        for row, future in zip(manifest, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append({
+                    'Organization': row['Organization'],
+                    'Collection': row['Collection'],
+                    'Dialect': row['Dialect'], 'Status': 'failed',
+                    'StepsRun': '', 'StepsSkipped': '', 'Elapsed': None,
+                    'Error': '{}: {}'.format(type(e).__name__, e)})
+    return pd.DataFrame(results, columns=BATCH_COLUMNS)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Evaluate and report on the collections of a batch '
+                    'manifest (Organization, Collection, Dialect, '
+                    'MetadataLocation).')
+    parser.add_argument('manifest', help='batch manifest csv')
+    parser.add_argument('--output', default='./data/',
+                        help='directory for evaluated metadata and reports')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='collections processed at a time')
+    parser.add_argument('--evaluator', choices=['service', 'local'],
+                        default='service')
+    parser.add_argument('--crosswalk', default='./AllCrosswalks.xml',
+                        help='crosswalk for the local evaluator')
+    parser.add_argument('--no-resume', dest='resume', action='store_false',
+                        help='ignore checkpoints and rerun every step')
+    parser.add_argument('--dialects',
+                        help='dialect registry csv (default '
+                             'dialectContains.csv)')
+    parser.add_argument('--report', choices=list(REPORT_BACKENDS),
+                        default='xlsx',
+                        help='format of the collection reports')
+    parser.add_argument('--status', help='write the batch status to a csv')
+    args = parser.parse_args(argv)
+    statusDF = runBatch(args.manifest, args.output, args.workers,
+                        args.resume, args.evaluator, args.crosswalk,
+                        args.report, args.dialects)
+    if args.status:
+        statusDF.to_csv(args.status, mode='w', index=False)
+    print(statusDF.to_string(index=False))
+    return int((statusDF['Status'] != 'done').any())
+
+
+if __name__ == '__main__':
+    sys.exit(main())